@@ -7,6 +7,12 @@ from azure.iot.device import ProvisioningDeviceClient, IoTHubDeviceClient, Metho
 import threading
 import queue
 import yaml
+try:
+    from yaml import CSafeLoader as YamlLoader # libyaml-backed
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+import pickle
+import glob
 import subprocess
 import git
 import os
@@ -16,6 +22,7 @@ import shutil
  # custom module
 import logger
 from slave import Slave # custom module
+from relay import Relay, DEFAULT_CHIP_PATH # custom module
 from led import LED # custom module
 from sense_current import ReliableCurrentSensing # custom module
 import network
@@ -26,18 +33,27 @@ HEARTBEAT_SEQUENCE_NUMBER = 0
 
 AZURE_CONFIG_PATH = "azure_config.yaml"
 APP_CONFIG_PATH = "app_config.yaml"
-RUNNING = True
+# flags shared between threads are Events: set/clear/is_set are synchronized
+RUNNING = threading.Event() # cleared by the Stop command
+RUNNING.set()
 STATE = "UNCONFIGURED"
-POWER_STATE = True # assume power is on at start, will be updated by power sensing task
+POWER_STATE = threading.Event() # set while the slave draws current, updated by power sensing task
+POWER_STATE.set() # assume power is on at start
 # ----------------------------------------------------
 # GLOBALS
 # ----------------------------------------------------
 send_queue = queue.Queue()
+SEND_BATCH_MAX = 16 # telemetry messages handed to one send_batch
+SEND_RETRY_MAX_SEC = 60.0 # cap of the sender's exponential backoff
+STOP_EVENT = threading.Event() # set on shutdown to wake sleeping workers
 CLIENT = None
-REALY_USED = False
+REALY_USED = threading.Event() # set while a slave power cycle is in progress
+_SLAVE = None # created on first restart, keeps the relay GPIO line requested
+_slave_lock = threading.Lock()
 DEVICE_ID = "0"
 DEPLOYMENT_DATE = "2024-01-01" # TODO: get from config or env variable
 HEARTBEAT_INTERVAL_SEC = 10.0
+MAX_HB_INTERVAL_SEC = 300.0 # send an unchanged heartbeat at least this often
 SLAVE_CONFIG = {"num": 0, "relay_gpio_line": 27, "power_off_delay_sec": 5.0, "slave_ip_address": "", "detect_power": False}
 LED_CONFIG = {"network_gpio_line": 4, "azure_gpio_line": 17}
 LOG_CONFIG = {"print_level": "info", "log_level": "info", "log_dir": "logs"}
@@ -95,12 +111,12 @@ def git_pull_repo():
 # change status
 # ----------------------------------------------------
 def slave_status():
-    global SLAVE_CONFIG, POWER_STATE
+    global SLAVE_CONFIG
     ip = SLAVE_CONFIG["slave_ip_address"]
     if ip == "":
         return "UNCONFIGURED"
     
-    if SLAVE_CONFIG["detect_power"] and not POWER_STATE:
+    if SLAVE_CONFIG["detect_power"] and not POWER_STATE.is_set():
         return "DOWN"
     
     if network.ping(ip):
@@ -112,14 +128,45 @@ def slave_status():
 # ----------------------------------------------------
 # CONFIGURAION
 # ----------------------------------------------------
+def load_cached_config(cache_path):
+    """Return the pickled config at cache_path, or None if it is missing or unreadable."""
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def save_cached_config(config_path, cache_path, cfg):
+    """Write cfg next to the yaml (tmp + rename) and remove caches of older versions."""
+    try:
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(cfg, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        for old_path in glob.glob(f"{glob.escape(config_path)}.*.pkl"):
+            if old_path != cache_path:
+                os.unlink(old_path)
+    except OSError as e:
+        logger.warn(f"Could not write config cache {cache_path}: {e}")
+
 def load_config(config_path):
+    """
+    Load a yaml config. The parsed dict is cached as <config>.<mtime_ns>.pkl,
+    so the yaml is only parsed again after the file changes.
+    """
     try:
+        cache_path = f"{config_path}.{os.stat(config_path).st_mtime_ns}.pkl"
+        cfg = load_cached_config(cache_path)
+        if cfg is not None:
+            logger.info(f"Configuration loaded from {cache_path}")
+            return cfg
         with open(config_path, "r") as f:
-            cfg = yaml.safe_load(f)
+            cfg = yaml.load(f, Loader=YamlLoader)
             logger.info(f"Configuration loaded from {config_path}")
     except Exception as e:
         logger.error(f"Failed to load configuration: {e}")
         raise RuntimeError("Cannot find configuration file")
+    save_cached_config(config_path, cache_path, cfg)
     return cfg
 
 def connection_string(config):
@@ -140,12 +187,19 @@ def connection_string(config):
 
 def parse_heartbeat_config(config):
     """Parse heartbeat configuration"""
-    global HEARTBEAT_INTERVAL_SEC
+    global HEARTBEAT_INTERVAL_SEC, MAX_HB_INTERVAL_SEC
     interval = int(config.get("heartbeat_interval_sec", HEARTBEAT_INTERVAL_SEC))
     if interval <= 0:
         logger.warn(f"Invalid heartbeat interval {interval}, using default {HEARTBEAT_INTERVAL_SEC}")
     HEARTBEAT_INTERVAL_SEC = interval
     logger.debug(f"Heartbeat interval: {HEARTBEAT_INTERVAL_SEC}")
+    max_interval = float(config.get("max_heartbeat_interval_sec", MAX_HB_INTERVAL_SEC))
+    if max_interval <= 0 or max_interval < HEARTBEAT_INTERVAL_SEC:
+        fallback = max(MAX_HB_INTERVAL_SEC, HEARTBEAT_INTERVAL_SEC)
+        logger.warn(f"Invalid max heartbeat interval {max_interval}, using {fallback}")
+        max_interval = fallback
+    MAX_HB_INTERVAL_SEC = max_interval
+    logger.debug(f"Max heartbeat interval: {MAX_HB_INTERVAL_SEC}")
     
 def parse_log_config(config):
     """Parse system configuration"""
@@ -249,29 +303,42 @@ def create_info_msg():
 # ======================================================
 # COMMAND PROCESSOR THREAD
 # ======================================================
+def get_slave():
+    global _SLAVE
+    with _slave_lock:
+        if _SLAVE is None:
+            _SLAVE = Slave(
+                relay_gpio_line=SLAVE_CONFIG["relay_gpio_line"],
+                num=SLAVE_CONFIG["num"],
+                debug=False
+            )
+        return _SLAVE
+
+def release_slave():
+    global _SLAVE
+    with _slave_lock:
+        if _SLAVE is not None:
+            _SLAVE.release()
+            _SLAVE = None
+
 def restart_slave_task(delay_sec):
-    global REALY_USED
+    # REALY_USED was already set by reboot_slave_cmd
     if delay_sec is None or delay_sec < 0:
         delay_sec = 0
     logger.debug(f"Restarting slave will start in {delay_sec} seconds...")
-    REALY_USED = True
     time.sleep(delay_sec)
     
-    Slave(
-        relay_gpio_line=SLAVE_CONFIG["relay_gpio_line"],
-        num=SLAVE_CONFIG["num"],
-        debug=False
-    ).power_cycle(off_duration=SLAVE_CONFIG["power_off_delay_sec"])
-    
-    REALY_USED = False
+    try:
+        get_slave().power_cycle(off_duration=SLAVE_CONFIG["power_off_delay_sec"])
+    finally:
+        REALY_USED.clear()
     logger.debug("Slave restarted and ready.")
     
 def stop_task():
-    global RUNNING
     delay_sec = 3
     logger.debug(f"Stop Running in {delay_sec} seconds...")
     time.sleep(delay_sec)
-    RUNNING = False
+    RUNNING.clear()
       
 def restart_device_task(thread_running_event):
     delay_min = 1
@@ -280,6 +347,7 @@ def restart_device_task(thread_running_event):
     command = f"sudo shutdown -r +{delay_min}"
     subprocess.run(command.split())
     thread_running_event.clear()  # signal threads to stop
+    STOP_EVENT.set()
       
 def update_repo_task():
     logger.debug("Updating repository...")
@@ -296,9 +364,10 @@ def reboot_slave_cmd(cmd_payload):
     #     reason = str(cmd_payload.get("reason"))
     # except Exception as e:
     #     logger.warn(f"Processing error: {e}") 
-    if REALY_USED:
+    if REALY_USED.is_set():
         logger.warn("Slave is already being restarted. Ignoring this command.")
         return True, "Slave is busy restarting", -1
+    REALY_USED.set() # before the thread starts, so a second command sees it
     logger.debug(f"Restarting in {delay} seconds. Reason: {reason}")
     threading.Thread(target=restart_slave_task, args=(delay, )).start()
     return True, "Reboot Success", 200
@@ -340,6 +409,15 @@ def set_slave_ip_cmd(cmd_payload):
         logger.debug(f"The requested slave ip address {new_ip} is not valid")
         return False, "Not valid ip address", 406
 
+# command name -> handler(payload, thread_running_event)
+_CMD_DISPATCH = {
+    "reboot_slave": lambda payload, running: reboot_slave_cmd(payload),
+    "configure_slave_ip": lambda payload, running: set_slave_ip_cmd(payload),
+    "Stop": lambda payload, running: stop_cmd(),
+    "restart_device": lambda payload, running: restart_device_cmd(running),
+    "update_repo": lambda payload, running: update_repo_cmd(),
+}
+
 def command_processor_task(thread_running_event):
     global CLIENT
     logger.info("Command processor ready...")
@@ -353,16 +431,9 @@ def command_processor_task(thread_running_event):
 
         try:
             # COMMAND ROUTING
-            if cmd_name == "reboot_slave":
-                success, message, code = reboot_slave_cmd(payload)
-            elif cmd_name == "configure_slave_ip":
-                success, message, code = set_slave_ip_cmd(payload)
-            elif cmd_name == "Stop":
-                success, message, code = stop_cmd()
-            elif cmd_name == "restart_device":
-                success, message, code = restart_device_cmd(thread_running_event)
-            elif cmd_name == "update_repo":
-                success, message, code = update_repo_cmd()
+            handler = _CMD_DISPATCH.get(cmd_name)
+            if handler is not None:
+                success, message, code = handler(payload, thread_running_event)
             else:
                 logger.warn(f"Unknown command {cmd_name}")
                 success, message, code = False, "Unknown command", 404
@@ -387,29 +458,58 @@ def command_processor_task(thread_running_event):
 # ----------------------------------------------------
 def sender_task(thread_running_event):
     global CLIENT
+    # failed messages are held here and retried with backoff instead of
+    # being put back into send_queue
+    pending = None
+    backoff = 1.0
     while thread_running_event.is_set():
-        msg = send_queue.get()  # blocking wait for next message
+        if pending:
+            batch = pending
+        else:
+            try:
+                # bounded wait so the loop notices thread_running_event being cleared
+                batch = [send_queue.get(timeout=1.0)]
+            except queue.Empty:
+                continue
+            # take whatever else is already queued, up to SEND_BATCH_MAX
+            while len(batch) < SEND_BATCH_MAX:
+                try:
+                    batch.append(send_queue.get_nowait())
+                except queue.Empty:
+                    break
 
         network.wait_until_connected()
 
         # Ensure Azure client is connected
         if not CLIENT.connect_to_iot_hub():
-            logger.warn("Will retry sending message later...")
-            time.sleep(5) # check_interval_sec
-            send_queue.put(msg)  # Put back into queue
+            logger.warn(f"Will retry sending message in {backoff:.0f} s...")
+            pending = batch
+            STOP_EVENT.wait(timeout=backoff)
+            backoff = min(backoff * 2, SEND_RETRY_MAX_SEC)
             continue
 
-        # Try sending the message
+        # Try sending: telemetry together, property updates one by one
+        telemetry = [msg for msg in batch if msg["type"] == my_azure.MSGTYPE[0]]
+        failed = []
         try:
-            CLIENT.send_with_timeout(msg)
+            if telemetry:
+                failed.extend(CLIENT.send_batch(telemetry))
+            for msg in batch:
+                if msg["type"] != my_azure.MSGTYPE[0] and not CLIENT.send_with_timeout(msg):
+                    failed.append(msg)
             
         except Exception as e:
             logger.error(f"send_message failed: {e}")
-            logger.warn("Will retry sending message later...")
-            time.sleep(5) # check_interval_sec
-            send_queue.put(msg)  # Put back into queue
+            failed = batch
 
-        time.sleep(0.1)  # prevent CPU spin
+        if failed:
+            logger.warn(f"Will retry sending message in {backoff:.0f} s...")
+            pending = failed
+            STOP_EVENT.wait(timeout=backoff)
+            backoff = min(backoff * 2, SEND_RETRY_MAX_SEC)
+        else:
+            pending = None
+            backoff = 1.0
     
     logger.info("Sender worker thread exiting...")
 
@@ -417,16 +517,28 @@ def sender_task(thread_running_event):
 # HEARTBEAT TASK THREAD – DIFFERENT RATE
 # ----------------------------------------------------
 def heartbeat_task(thread_running_event):
-    global CLIENT # TODO: check if this is needed ?!
-    last_time = 0
+    # fire on a monotonic schedule and sleep until the next deadline;
+    # STOP_EVENT cuts the sleep short on shutdown
+    next_fire = time.monotonic()
+    # unchanged heartbeats are only sent every MAX_HB_INTERVAL_SEC,
+    # a status change is sent right away
+    last_status = None
+    last_send = 0.0
     while thread_running_event.is_set():
-        now = time.time()
-        if now - last_time >= HEARTBEAT_INTERVAL_SEC:
-            last_time = now
-            message = create_heartbeat(slave_status_str=slave_status())
-            logger.debug(f"Queuing message: {message}")
+        sleep_for = next_fire - time.monotonic()
+        if sleep_for > 0 and STOP_EVENT.wait(timeout=sleep_for):
+            break
+        status = slave_status()
+        now = time.monotonic()
+        if status != last_status or (now - last_send) >= MAX_HB_INTERVAL_SEC:
+            message = create_heartbeat(slave_status_str=status)
+            logger.debug("Queuing message: %s", message)
             send_queue.put(my_azure.create_telementry_message_pair(message))
-        time.sleep(0.1)
+            last_status = status
+            last_send = now
+        next_fire += HEARTBEAT_INTERVAL_SEC
+        if next_fire < time.monotonic():
+            next_fire = time.monotonic() + HEARTBEAT_INTERVAL_SEC  # fell behind, don't burst
         
 # ----------------------------------------------------
 # LED TASK THREAD – DIFFERENT RATE
@@ -452,14 +564,13 @@ def led_task(thread_running_event):
 # LED TASK THREAD – DIFFERENT RATE
 # ----------------------------------------------------
 def power_task(thread_running_event):
-    global POWER_STATE
     sensor = ReliableCurrentSensing()
     while thread_running_event.is_set():
         if sensor.is_current_detected_for_window(debug=False):
-            POWER_STATE = True
+            POWER_STATE.set()
             logger.debug("Current detected. Power state ON.")
         else:
-            POWER_STATE = False
+            POWER_STATE.clear()
             logger.debug("No current detected. Power state OFF.")
         time.sleep(15)  # check every 15 seconds
 # ----------------------------------------------------
@@ -480,17 +591,23 @@ def main():
 
     azure_config = load_config(config_path=AZURE_CONFIG_PATH)
     parse_slave_config(azure_config)
+
+    # Start background sender thread
+    thread_running_event = threading.Event()
+    thread_running_event.set()
+    # create threads
+    sender_worker = threading.Thread(target=sender_task, args=(thread_running_event,), daemon=True)
+    heartbeat_worker = threading.Thread(target=heartbeat_task, args=(thread_running_event,), daemon=True)
+    command_processor_worker = threading.Thread(target=command_processor_task, args=(thread_running_event,), daemon=True)
+    led_worker = threading.Thread(target=led_task, args=(thread_running_event,), daemon=True)
+    power_worker = threading.Thread(target=power_task, args=(thread_running_event,), daemon=True)
     try:
-        
-        # Start background sender thread
-        thread_running_event = threading.Event()
-        thread_running_event.set()
-        # create threads
-        sender_worker = threading.Thread(target=sender_task, args=(thread_running_event,), daemon=True)
-        heartbeat_worker = threading.Thread(target=heartbeat_task, args=(thread_running_event,), daemon=True)
-        command_processor_worker = threading.Thread(target=command_processor_task, args=(thread_running_event,), daemon=True)
-        led_worker = threading.Thread(target=led_task, args=(thread_running_event,), daemon=True)
-        power_worker = threading.Thread(target=power_task, args=(thread_running_event,), daemon=True)
+        # relay and both LEDs share one GPIO line request
+        Relay.configure_lines(DEFAULT_CHIP_PATH, (
+            SLAVE_CONFIG["relay_gpio_line"],
+            LED_CONFIG["network_gpio_line"],
+            LED_CONFIG["azure_gpio_line"],
+        ))
         
         # start debug thread
         led_worker.start()
@@ -515,21 +632,25 @@ def main():
         msg = create_info_msg()
         send_queue.put(my_azure.create_property_message_pair(msg))
             
-        while RUNNING:
+        while RUNNING.is_set():
             time.sleep(1)
 
     except KeyboardInterrupt:
         logger.warn("User canceled the program...")
         
     finally:
-        thread_running.clear()
+        thread_running_event.clear()
+        STOP_EVENT.set()
         logger.close_logger()
-        CLIENT.disconnect()
-        led_worker.join(timeout=1)
-        sender_worker.join(timeout=2)
-        heartbeat_worker.join(timeout=1)
-        command_processor_worker.join(timeout=1)
-        power_worker.join(timeout=1)
+        if CLIENT is not None:
+            CLIENT.disconnect()
+        # setup may have failed before some of the threads were started
+        for worker, timeout in ((led_worker, 1), (sender_worker, 2), (heartbeat_worker, 1),
+                                (command_processor_worker, 1), (power_worker, 1)):
+            if worker.ident is not None:
+                worker.join(timeout=timeout)
+        release_slave()
+        Relay.release_lines(DEFAULT_CHIP_PATH)
         time.sleep(2)  # wait for sender thread to exit
         logger.info("Disconnected.")
         logger.info("Exiting.")
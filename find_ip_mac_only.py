@@ -1,27 +1,73 @@
 #!/usr/bin/env python3
 import subprocess
+import concurrent.futures
 import re
 import ipaddress
-from typing import Optional, Tuple, List, Dict
+import json
+import os
+import time
+from typing import Optional, Tuple, List, Dict, Iterable, Iterator
 import logger
+import socket
 import sys
 
+# pyroute2 reads routes, addresses and neighbours over netlink; without it
+# the same data is parsed from `ip` output
+try:
+    from pyroute2 import IPRoute
+except ImportError:
+    IPRoute = None
+
+MAC_RESOLVE_WORKERS = 32 # hosts resolved at once after the scan
+SLAVE_IP_CACHE_PATH = "slave_ip_cache.json" # last found (subnet, mac, ip)
+
 # Put your known vendor OUIs here (uppercase)
 VENDOR_OUIS = {
     "00:01:A9",
 }
 
+# compiled once at import, used on every call
+_IFACE_RE = re.compile(r"\bdev\s+(\S+)")
+_CIDR_RE = re.compile(r"\binet\s+(\d+\.\d+\.\d+\.\d+/\d+)\b")
+_REPORT_RE = re.compile(r"Nmap scan report for\s+(.+)$")
+_REPORT_IP_RE = re.compile(r"\((\d+\.\d+\.\d+\.\d+)\)$")
+_NEIGH_RE = re.compile(r"^(\d+\.\d+\.\d+\.\d+)\s+.*\blladdr\s+([0-9A-Fa-f:]{17})\s.*?([A-Z]+)\s*$", re.M)
+
+# kernel NUD_* neighbour states, as reported by netlink
+NUD_STATES = {0x01: "INCOMPLETE", 0x02: "REACHABLE", 0x04: "STALE", 0x08: "DELAY",
+              0x10: "PROBE", 0x20: "FAILED", 0x40: "NOARP", 0x80: "PERMANENT"}
+NEIGH_UNUSABLE = {"INCOMPLETE", "FAILED"}
+NEIGH_UNCONFIRMED = {"STALE", "DELAY", "PROBE"}  # the host may have left since
+
 def run(cmd: List[str]) -> str:
     return subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
 
 def get_default_iface() -> Optional[str]:
+    if IPRoute is not None:
+        with IPRoute() as ipr:
+            routes = ipr.get_default_routes(family=socket.AF_INET)
+            if not routes:
+                return None
+            links = ipr.get_links(routes[0].get_attr("RTA_OIF"))
+            return links[0].get_attr("IFLA_IFNAME") if links else None
+
     out = run(["ip", "route", "show", "default"]).strip()
-    m = re.search(r"\bdev\s+(\S+)", out)
+    m = _IFACE_RE.search(out)
     return m.group(1) if m else None
 
 def get_iface_cidr(iface: str) -> Optional[str]:
+    if IPRoute is not None:
+        with IPRoute() as ipr:
+            index = ipr.link_lookup(ifname=iface)
+            if not index:
+                return None
+            addrs = ipr.get_addr(family=socket.AF_INET, index=index[0])
+            if not addrs:
+                return None
+            return f"{addrs[0].get_attr('IFA_ADDRESS')}/{addrs[0]['prefixlen']}"
+
     out = run(["ip", "-4", "addr", "show", "dev", iface])
-    m = re.search(r"\binet\s+(\d+\.\d+\.\d+\.\d+/\d+)\b", out)
+    m = _CIDR_RE.search(out)
     return m.group(1) if m else None
 
 def get_subnet_from_default_route() -> Tuple[str, str, str]:
@@ -34,49 +80,144 @@ def get_subnet_from_default_route() -> Tuple[str, str, str]:
     subnet = str(ipaddress.ip_network(cidr, strict=False))
     return iface, cidr, subnet
 
-def parse_nmap_sn_alive_ips(nmap_out: str) -> List[str]:
+def iter_nmap_sn_alive_ips(lines: Iterable[str]) -> Iterator[str]:
     """
-    Parse `nmap -sn` output and return list of alive IPs.
+    Yield alive IPs from `nmap -sn` output lines as soon as each host
+    block is complete.
     """
-    ips = []
     current_ip: Optional[str] = None
     alive = False
 
-    for line in nmap_out.splitlines():
+    for line in lines:
         line = line.strip()
 
-        m = re.search(r"Nmap scan report for\s+(.+)$", line)
+        # Nmap prints: "Host is up (0.0010s latency)."
+        if line.startswith("Host is up"):
+            alive = current_ip is not None
+            continue
+
+        m = _REPORT_RE.match(line)
         if m:
             # finalize previous host
             if current_ip and alive:
-                ips.append(current_ip)
+                yield current_ip
 
             host = m.group(1)
-            ip_match = re.search(r"\((\d+\.\d+\.\d+\.\d+)\)$", host)
+            ip_match = _REPORT_IP_RE.search(host)
             current_ip = ip_match.group(1) if ip_match else host
             alive = False
-            continue
-
-        # Nmap prints: "Host is up (0.0010s latency)."
-        if current_ip and line.startswith("Host is up"):
-            alive = True
 
     if current_ip and alive:
-        ips.append(current_ip)
+        yield current_ip
+
+def parse_nmap_sn_alive_ips(nmap_out: str) -> List[str]:
+    """
+    Parse `nmap -sn` output and return list of alive IPs.
+    """
+    return list(iter_nmap_sn_alive_ips(nmap_out.splitlines()))
 
+def scan_alive_ips(cmd: List[str]) -> List[str]:
+    """
+    Run an `nmap -sn` command and parse its stdout line by line while the
+    scan is still running, instead of waiting for the whole output.
+    """
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+        ips = list(iter_nmap_sn_alive_ips(proc.stdout))
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
     return ips
 
-def get_mac_from_ip_neigh(ip: str) -> Optional[str]:
+def get_neighbours(ip: Optional[str] = None) -> List[Tuple[str, str, str]]:
+    """
+    Return (ip, MAC, NUD state) triples from the kernel IPv4 neighbour
+    table, only for ip if given. Entries without a link-layer address are
+    skipped.
+    """
+    if IPRoute is not None:
+        filters = {"dst": ip} if ip else {}
+        with IPRoute() as ipr:
+            entries = ipr.get_neighbours(family=socket.AF_INET, **filters)
+        return [(n.get_attr("NDA_DST"), n.get_attr("NDA_LLADDR").upper(), NUD_STATES.get(n["state"], "NONE"))
+                for n in entries if n.get_attr("NDA_LLADDR")]
+
     try:
-        out = run(["ip", "neigh", "show", ip])
+        out = run(["ip", "-4", "neigh", "show"] + ([ip] if ip else []))
     except Exception:
-        return None
-    m = re.search(r"lladdr\s+([0-9A-Fa-f:]{17})", out)
-    return m.group(1).upper() if m else None
+        return []
+    return [(addr, mac.upper(), state) for addr, mac, state in _NEIGH_RE.findall(out)]
+
+def get_mac_from_ip_neigh(ip: str) -> Optional[str]:
+    for addr, mac, _ in get_neighbours(ip):
+        if addr == ip:
+            return mac
+    return None
 
 def oui(mac: str) -> str:
     return ":".join(mac.split(":")[:3]).upper()
 
+def probe_host(ip: str) -> bool:
+    """Ping ip once; True if it answered. Also refreshes its ARP entry."""
+    return subprocess.run(["ping", "-c", "1", "-W", "1", ip],
+                          capture_output=True, text=True, check=False).returncode == 0
+
+def resolve_mac(ip: str) -> Tuple[str, Optional[str]]:
+    """Return (ip, MAC), pinging once to populate the ARP entry if needed."""
+    mac = get_mac_from_ip_neigh(ip)
+    if not mac:
+        # Sometimes ARP entry isn't present yet; try to “touch” it once
+        probe_host(ip)
+        mac = get_mac_from_ip_neigh(ip)
+    return ip, mac
+
+def find_vendor_ip_in_arp_cache(subnet: str) -> Optional[Tuple[str, str]]:
+    """
+    Look for a vendor MAC in the kernel neighbour table (read once) and
+    return (ip, mac) of the first match inside subnet, or None. FAILED and
+    INCOMPLETE entries are skipped; a STALE (or DELAY/PROBE) hit is only
+    returned if it answers a ping with the same MAC.
+    """
+    network = ipaddress.ip_network(subnet, strict=False)
+    for ip, mac, state in get_neighbours():
+        if state in NEIGH_UNUSABLE or oui(mac) not in VENDOR_OUIS or ipaddress.ip_address(ip) not in network:
+            continue
+        if state in NEIGH_UNCONFIRMED and not (probe_host(ip) and get_mac_from_ip_neigh(ip) == mac):
+            logger.debug(f" {ip:15}  MAC={mac} was {state} and did not answer, skipped")
+            continue
+        return ip, mac
+    return None
+
+def load_cached_slave_ip(subnet: str) -> Optional[str]:
+    """
+    Return the cached slave IP for subnet if that IP still answers a ping
+    and its neighbour entry has the cached MAC. An old ARP entry alone is
+    not trusted. A stale cache is removed.
+    """
+    try:
+        with open(SLAVE_IP_CACHE_PATH, "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("subnet") != subnet:
+        return None
+    ip, mac = cached.get("ip"), cached.get("mac")
+    if ip and mac and probe_host(ip) and get_mac_from_ip_neigh(ip) == mac:
+        return ip
+    logger.debug(f"Cached slave {ip} ({mac}) no longer matches, rescanning.")
+    try:
+        os.remove(SLAVE_IP_CACHE_PATH)
+    except OSError:
+        pass
+    return None
+
+def save_cached_slave_ip(subnet: str, ip: str, mac: str) -> None:
+    try:
+        tmp_path = SLAVE_IP_CACHE_PATH + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"subnet": subnet, "mac": mac, "ip": ip, "ts": time.time()}, f)
+        os.replace(tmp_path, SLAVE_IP_CACHE_PATH)
+    except OSError as e:
+        logger.warn(f"Could not write {SLAVE_IP_CACHE_PATH}: {e}")
+
 def find_vendor_ips_in_subnet(subnet: str) -> str:
     """
     Scans the given subnet for hosts with MAC OUIs matching VENDOR_OUIS.
@@ -89,26 +230,36 @@ def find_vendor_ips_in_subnet(subnet: str) -> str:
         logger.debug(f"CIDR: {cidr}")
         logger.debug(f"Subnet: {subnet}\n")
 
-    # Key change: -PR forces ARP discovery on local LAN, -n disables DNS (faster/cleaner)
-    logger.debug("Discovering hosts using ARP-based discovery (nmap -sn -PR -n) ...")
-    nmap_out = run(["nmap", "-sn", "-PR", "-n", subnet])
+    # Same slave as last time? Then a single probe is enough
+    ip = load_cached_slave_ip(subnet)
+    if ip:
+        logger.debug(f" {ip:15}  <-------- MATCH! ({SLAVE_IP_CACHE_PATH})")
+        return ip
+
+    # The slave is usually already in the ARP cache, skip the scan then
+    cached = find_vendor_ip_in_arp_cache(subnet)
+    if cached:
+        ip, mac = cached
+        logger.debug(f" {ip:15}  MAC={mac}  OUI={oui(mac)} <-------- MATCH! (ARP cache)")
+        save_cached_slave_ip(subnet, ip, mac)
+        return ip
 
-    ips = parse_nmap_sn_alive_ips(nmap_out)
+    # Key change: -PR forces ARP discovery on local LAN, -n disables DNS (faster/cleaner),
+    # -T4 --min-parallelism 32 probes many hosts at once
+    logger.debug("Discovering hosts using ARP-based discovery (nmap -sn -PR -n -T4) ...")
+    ips = scan_alive_ips(["nmap", "-sn", "-PR", "-n", "-T4", "--min-parallelism", "32", subnet])
     if not ips:
         logger.warn("No alive hosts found.")
         return
 
     logger.debug(f"Found {len(ips)} alive host(s). Checking MAC OUIs...\n")
 
-    matches = []
-    for ip in ips:
-        mac = get_mac_from_ip_neigh(ip)
-        if not mac:
-            # Sometimes ARP entry isn't present yet; try to “touch” it once
-            subprocess.run(["ping", "-c", "1", "-W", "1", ip],
-                           capture_output=True, text=True, check=False)
-            mac = get_mac_from_ip_neigh(ip)
+    # each miss costs up to a 1 s ping, so resolve all hosts concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(MAC_RESOLVE_WORKERS, len(ips))) as executor:
+        resolved = list(executor.map(resolve_mac, ips))
 
+    matches = []
+    for ip, mac in resolved:
         if not mac:
             logger.debug(f" {ip:15}  MAC=UNKNOWN (couldn't resolve)")
             continue
@@ -124,6 +275,7 @@ def find_vendor_ips_in_subnet(subnet: str) -> str:
     if matches:
         for ip, mac in matches:
             logger.debug(f"  - {ip} ({mac})")
+        save_cached_slave_ip(subnet, *matches[0])
         return matches[0][0]  # return first matching IP
     else:
         logger.debug("No vendor OUI matches found. Verify OUIs and that device is on the same subnet/L2.")
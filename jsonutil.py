@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+import json
+
+# JSON helpers shared by the device clients. orjson is a C extension and
+# much faster than the stdlib json module, which is used when it is missing.
+try:
+    import orjson
+
+    dumps_bytes = orjson.dumps  # returns utf-8 bytes
+    loads = orjson.loads  # accepts bytes directly
+except ImportError:
+    def dumps_bytes(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    def loads(data):
+        return json.loads(data.decode("utf-8") if isinstance(data, bytes) else data)
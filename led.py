@@ -1,4 +1,4 @@
-from relay import Relay
+from relay import Relay, debug_printer
 import time
 import signal
 import sys
@@ -8,19 +8,16 @@ class LED:
         self.relay = Relay(gpio_line, debug=debug)
         self.name = name
         self.debug = debug
-        self.debug_print(f"[LED][{self.name}]: initialized")
+        self.debug_print = debug_printer(debug)
+        self.debug_print("[LED][%s]: initialized", self.name)
         
     def turn_on(self):
-        self.debug_print(f"[LED][{self.name}]: Turning ON the LED device.")
+        self.debug_print("[LED][%s]: Turning ON the LED device.", self.name)
         self.relay.turn_on()  # Assuming inactive LOW turns ON the LED
         
     def turn_off(self):
-        self.debug_print(f"[LED][{self.name}]: Turning OFF the LED device.")
+        self.debug_print("[LED][%s]: Turning OFF the LED device.", self.name)
         self.relay.turn_off()  # Assuming inactive LOW turns OFF the LED
-        
-    def debug_print(self, message: str):
-        if self.debug:
-            print(message)
                  
     def __exit__(self):
         """
@@ -1,8 +1,9 @@
 import os
+import sys
 import threading
 import queue
 import time
-import inspect
+import atexit
 from datetime import datetime
 
 # -----------------------------
@@ -46,9 +47,16 @@ COLORS = {
     "END":   "\033[0m"
 }
 
-# Thread-safe queue for async logging
+# Thread-safe queue for async logging; the worker thread is the only
+# writer, so terminal and file output stay in call order. WARN/ERROR
+# callers wait until their entry is written so it is seen even if the
+# process dies right after. Once the worker is gone entries are written
+# directly by the caller.
 log_queue = queue.Queue()
 stop_signal = False
+SYNC_PRINT_LEVEL = LEVELS["WARN"]
+SYNC_WAIT_SEC = 1.0  # longest a WARN/ERROR caller waits for the worker
+_write_lock = threading.Lock()
 
 # -----------------------------
 # INTERNAL HELPERS
@@ -94,15 +102,16 @@ def _rotate_if_needed(log_file):
                 break
             i += 1
 
-def _async_log_worker():
-    """Background thread that processes queued log entries."""
-    global stop_signal, MSG_COUNTER
-    while not stop_signal or not log_queue.empty():
-        try:
-            level, message = log_queue.get(timeout=0.5)
-        except queue.Empty:
-            continue
+def _write_entry(level, message, to_terminal, to_file):
+    """Print and/or append one entry to its level's log file."""
+    global MSG_COUNTER
+    # TERMINAL PRINTING (with color)
+    if to_terminal:
+        print(f"{COLORS[level]}[{level}] {message}{COLORS['END']}")
+    if not to_file:
+        return
 
+    with _write_lock:
         log_file = LOG_FILES[level]
         # _create_log_files_if_needed() 
         _rotate_if_needed(log_file)  # rotate file if needed
@@ -111,20 +120,43 @@ def _async_log_worker():
         timestamp = datetime.now().strftime("%H:%M:%S")
         log_line = f"{MSG_COUNTER:06d} [{timestamp}] [{level}] {message}\n"
 
-        # Thread-safe file write
         with open(log_file, "a") as f:
             f.write(log_line)
 
+def _handle_entry(entry):
+    level, message, to_terminal, to_file, done = entry
+    _write_entry(level, message, to_terminal, to_file)
+    if done is not None:
+        done.set()
+
+def _drain_queue():
+    while True:
+        try:
+            entry = log_queue.get_nowait()
+        except queue.Empty:
+            return
+        _handle_entry(entry)
+
+def _async_log_worker():
+    """Background thread that processes queued log entries."""
+    while not stop_signal or not log_queue.empty():
+        try:
+            entry = log_queue.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        _handle_entry(entry)
+
 def _get_caller():
     """
     Return accurate caller even when the logging API is nested.
+    Walks the raw frames; inspect.stack() would also read source lines.
     """
-    stack = inspect.stack()
-
-    for frame in stack:
-        fname = os.path.basename(frame.filename)
+    frame = sys._getframe(1)
+    while frame is not None:
+        fname = os.path.basename(frame.f_code.co_filename)
         if fname != "logger.py":        # skip internal logger calls
-            return f"{fname}:{frame.lineno}"
+            return f"{fname}:{frame.f_lineno}"
+        frame = frame.f_back
 
     return "unknown:0"
 
@@ -175,41 +207,62 @@ def set_file_logging_enabled(enabled):
     global ENABLE_FILE_LOGGING
     ENABLE_FILE_LOGGING = enabled
 
-def debug(message): trace("DEBUG", message)
-def info(message): trace("INFO", message)
-def warn(message): trace("WARN", message)
-def error(message): trace("ERROR", message)
+def debug(message, *args): trace("DEBUG", message, *args)
+def info(message, *args): trace("INFO", message, *args)
+def warn(message, *args): trace("WARN", message, *args)
+def error(message, *args): trace("ERROR", message, *args)
 
-def trace(level, message):
+def trace(level, message, *args):
     """
-    Print to terminal (with colors) and store in log file (async).
+    Print to terminal (with colors) and store in log file. Both are done by
+    the logger thread in call order; DEBUG/INFO callers never block on them,
+    WARN/ERROR callers wait until the entry is written.
     Includes filename + line number automatically.
+    Extra args are %-formatted into message only if the level is enabled,
+    e.g. trace("DEBUG", "Queuing message: %s", payload).
     """
     level = level.upper()
     if level not in LOG_FILES:
         raise ValueError(f"Invalid log level: {level}")
 
+    to_terminal = LEVELS[level] >= PRINT_LEVEL
+    to_file = ENABLE_FILE_LOGGING and LEVELS[level] >= LOGGING_LEVEL
+    if not to_terminal and not to_file:
+        return  # skip formatting and the caller lookup entirely
+
+    if args:
+        message = message % args
+
     caller = _get_caller()
 
     # Add context to message
     context_msg = f"({caller}) {message} "
 
-    # TERMINAL PRINTING (with color)
-    if LEVELS[level] >= PRINT_LEVEL:
-        color = COLORS[level]
-        print(f"{color}[{level}] {context_msg}{COLORS['END']}")
-    
-    # FILE LOGGING
-    if ENABLE_FILE_LOGGING and LEVELS[level] >= LOGGING_LEVEL:
-        # Put into async log queue
-        log_queue.put((level, context_msg))
+    if not log_thread.is_alive():
+        # logger thread is gone, write what it left behind and then this entry
+        _drain_queue()
+        _write_entry(level, context_msg, to_terminal, to_file)
+        return
+
+    # Put into async log queue
+    done = threading.Event() if LEVELS[level] >= SYNC_PRINT_LEVEL else None
+    log_queue.put((level, context_msg, to_terminal, to_file, done))
+    if done is not None and not done.wait(SYNC_WAIT_SEC) and not log_thread.is_alive():
+        _drain_queue()  # the thread exited before taking our entry
 
 # -----------------------------
 # CLEAN SHUTDOWN (optional)
 # -----------------------------
 
 def close_logger():
-    """Flush and stop logging thread cleanly (call on shutdown)."""
+    """
+    Flush and stop logging thread cleanly (call on shutdown; also runs at
+    exit). Later messages are written directly.
+    """
     global stop_signal
     stop_signal = True
     log_thread.join(timeout=2)
+    if not log_thread.is_alive():
+        _drain_queue()  # entries queued while the thread was exiting
+
+atexit.register(close_logger)
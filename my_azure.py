@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
 import time
-import json
+import asyncio
 import concurrent.futures
-from azure.iot.device import ProvisioningDeviceClient, IoTHubDeviceClient, MethodResponse, Message
+from azure.iot.device import ProvisioningDeviceClient, MethodResponse, Message
+from azure.iot.device.aio import IoTHubDeviceClient
 import threading
 import queue
 import logger # custom logger module
+import jsonutil
 
 # ----------------------------------------------------
 # GLOBALS
@@ -16,7 +18,7 @@ RECONNECT_INTERVAL = 5.0 # sec
 RESEND_INTERVAL = 15.0 # sec
 
 def prepaere_telemetry_message(message):
-    telemetry = Message(json.dumps(message))
+    telemetry = Message(jsonutil.dumps_bytes(message))  # bytes, published without re-encoding
     telemetry.content_type = "application/json"
     telemetry.content_encoding = "utf-8"
     return telemetry
@@ -58,14 +60,30 @@ def create_connection_str_from_dps(device_id, id_scope, symmetric_key, provision
     logger.debug(f"Generated device connection string: {device_conn_str}")
     return device_conn_str
 
+async def _create_client(conn_str):
+    # created on the loop that will drive it
+    return IoTHubDeviceClient.create_from_connection_string(conn_str)
+
 class Client():
+    """
+    Synchronous facade over the asyncio IoT Hub client. The client lives on
+    an event loop in its own thread; the public methods hand coroutines to
+    that loop and wait for the result, so callers stay plain threads.
+    """
     def __init__(self, conn_str):
         
         logger.info("Creating new IoTHubDeviceClient...")
-        self.client = IoTHubDeviceClient.create_from_connection_string(conn_str)
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="iot-aio", daemon=True)
+        self._loop_thread.start()
+        self.client = self._run(_create_client(conn_str))
         self.lock = threading.Lock()
         self.command_queue = queue.Queue()
         self.device_id = self.extract_device_id(conn_str)
+
+    def _run(self, coro, timeout=None):
+        """Run coro on the client's event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
     
     def extract_device_id(self, conn_str):
         # 1. Split by semicolon into a list of components
@@ -80,28 +98,59 @@ class Client():
             logger.warn("No message to send.")
             return True  # nothing to send
         
-        logger.debug(f"Sending: {message}")
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-            if message["type"] == MSGTYPE[0]:  # telemetry
-                future = executor.submit(self.client.send_message, message["msg"])
-                
-            elif message["type"] == MSGTYPE[1]:  # propertyUpdate
-                future = executor.submit(self.client.patch_twin_reported_properties, message["msg"])
+        logger.debug("Sending: %s", message)
+
+        if message["type"] == MSGTYPE[0]:  # telemetry
+            coro = self.client.send_message(message["msg"])
             
-            try:
-                future.result(timeout=RESEND_INTERVAL)
-                logger.info("Message sent successfully.")
-                return True
+        elif message["type"] == MSGTYPE[1]:  # propertyUpdate
+            coro = self.client.patch_twin_reported_properties(message["msg"])
+        
+        try:
+            # the timeout is enforced on the loop, which also cancels the send
+            self._run(asyncio.wait_for(coro, timeout=RESEND_INTERVAL))
+            logger.info("Message sent successfully.")
+            return True
+
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError) as exc:
+            logger.error(f"send_message timed out: {exc} after {RESEND_INTERVAL} sec")
+            return False
+
+        except Exception as e:
+            logger.error(f"send_message failed: {e}")
+            return False
+    
+    async def _send_all(self, messages):
+        return await asyncio.gather(*(self.client.send_message(m) for m in messages),
+                                    return_exceptions=True)
 
-            except concurrent.futures.TimeoutError as exc:
-                logger.error(f"send_message timed out: {exc} after {RESEND_INTERVAL} sec")
-                return False
+    def send_batch(self, messages):
+        """
+        Send several telemetry pairs under one timeout. Every pair stays its
+        own D2C message (MQTT does not split batches, the hub would route one
+        JSON array); they are published concurrently on the client's loop.
+        Returns the pairs that were not sent.
+        """
+        if len(messages) == 1:
+            return [] if self.send_with_timeout(messages[0]) else list(messages)
+
+        logger.debug("Sending %d telemetry messages", len(messages))
+        try:
+            results = self._run(asyncio.wait_for(self._send_all([m["msg"] for m in messages]),
+                                                 timeout=RESEND_INTERVAL))
+        except (asyncio.TimeoutError, concurrent.futures.TimeoutError) as exc:
+            logger.error(f"send_message timed out: {exc} after {RESEND_INTERVAL} sec")
+            return list(messages)
+
+        failed = []
+        for message, result in zip(messages, results):
+            if isinstance(result, Exception):
+                logger.error(f"send_message failed: {result}")
+                failed.append(message)
+        if len(failed) < len(messages):
+            logger.info("%d messages sent successfully.", len(messages) - len(failed))
+        return failed
 
-            except Exception as e:
-                logger.error(f"send_message failed: {e}")
-                return False
-    
     def is_connected_to_iot_hub(self, debug=False):
         with self.lock:
             if self.client.connected:
@@ -118,7 +167,7 @@ class Client():
             if not self.client.connected:
                 try:
                     logger.info("Connecting to Azure IoT Hub...")
-                    self.client.connect()
+                    self._run(self.client.connect())
                     logger.info("Successfully connected to IoT Hub.")
 
                 except Exception as e:
@@ -138,10 +187,12 @@ class Client():
         self.command_queue.put(method_request)
     
     def send_method_response(self, response):
-        self.client.send_method_response(response)
+        self._run(self.client.send_method_response(response))
     
     def disconnect(self):
-        self.client.disconnect()
+        self._run(self.client.disconnect())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop_thread.join(timeout=1)
         logger.info("Disconnected.")
         
     def __exit__(self):
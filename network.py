@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
 import socket
-import subprocess
 import platform
 import logger
 import ipaddress
 import time
+import concurrent.futures
+import select
+import struct
+import array
+import os
 
 CHECK_INTERVAL = 5.0 # sec
+DNS_TTL = 60.0 # sec
+SLAVE_PROBE_PORT = 443
+SLAVE_PROBE_TIMEOUT = 0.5 # sec
+_dns_cache = {} # host -> (ip, monotonic ts)
+_icmp_allowed = True # cleared once the kernel refuses unprivileged ICMP sockets
+_icmp_seq = 0
+# probed only after the caller's host failed; IP literals still answer when only DNS is down
+PROBE_FALLBACK_TARGETS = (("8.8.8.8", 53), ("1.1.1.1", 53))
+_PROBE_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=len(PROBE_FALLBACK_TARGETS), thread_name_prefix="net-probe")
+CONNECTED_TTL = 2.0 # sec an is_connected answer is reused
+_connected_cache = {} # (host, port) -> (ok, monotonic ts)
 # ----------------------------------------------------
 # NETWORK CHECK
 # ----------------------------------------------------
@@ -19,62 +34,152 @@ def is_valid_ip(ip_str):
     except ValueError:
         return False
     
-def ping(ip_address):
+def _checksum(data):
+    """Internet checksum (RFC 1071) of an ICMP packet."""
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(array.array("H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return (~total) & 0xFFFF
+
+def icmp_ping(ip_address, timeout=SLAVE_PROBE_TIMEOUT):
     """
-    Pings a given IP address and returns True if reachable, False otherwise.
+    Send one ICMP echo over an unprivileged datagram socket
+    (net.ipv4.ping_group_range) and wait for the reply.
+    Raises PermissionError when such sockets are not allowed.
     """
-    command = ["ping", "-c", "1", ip_address]
-
-    try:
-        # Execute the ping command
-        # capture_output=True captures stdout and stderr
-        # text=True decodes output as text
-        # timeout sets a limit for the command execution
-        logger.debug(f"trying to ping {ip_address}")
-        result = subprocess.run(command, capture_output=True, text=True, timeout=5)
+    global _icmp_seq
+    _icmp_seq = (_icmp_seq + 1) & 0xFFFF
+    header = struct.pack("!BBHHH", 8, 0, 0, os.getpid() & 0xFFFF, _icmp_seq)
+    payload = b"iot-azure"
+    packet = header[:2] + struct.pack("=H", _checksum(header + payload)) + header[4:] + payload
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP) as s:
+        s.sendto(packet, (ip_address, 0))
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([s], [], [], remaining)[0]:
+                return False
+            reply = s.recv(1024)
+            if reply[:1] == b"\0":  # echo reply
+                return True
 
-        # Check the return code: 0 usually means success
-        if result.returncode == 0:
-            logger.debug(f"{ip_address} is reachable.")
-            return True
-        else:
-            logger.debug(f"{ip_address} is unreachable. Output:\n{result.stdout}{result.stderr}")
+def ping(ip_address, port=SLAVE_PROBE_PORT, timeout=SLAVE_PROBE_TIMEOUT):
+    """
+    Checks whether a given IP address is reachable with a single ICMP echo.
+    A missed echo or ICMP error counts as unreachable, no second probe is
+    sent. Only where unprivileged ICMP sockets are not allowed, opens a TCP
+    connection to its service port instead (443 by default, the port the
+    slave scan looks for). No ping process is forked in either case.
+    Returns True if reachable, False otherwise.
+    """
+    global _icmp_allowed
+    if _icmp_allowed:
+        try:
+            if icmp_ping(ip_address, timeout):
+                logger.debug("%s is reachable.", ip_address)
+                return True
+            logger.debug("No ICMP echo reply from %s.", ip_address)
             return False
-    except subprocess.TimeoutExpired:
-        logger.debug(f"Ping to {ip_address} timed out.")
-        return False
-    except FileNotFoundError:
-        logger.debug("Error: 'ping' command not found. Ensure it's in your system's PATH.")
+        except PermissionError:
+            logger.debug("ICMP sockets not permitted, falling back to TCP probes.")
+            _icmp_allowed = False
+        except OSError as e:
+            logger.debug("ICMP echo to %s failed: %s", ip_address, e)
+            return False
+    try:
+        logger.debug("trying to reach %s:%s", ip_address, port)
+        with socket.create_connection((ip_address, port), timeout=timeout):
+            pass
+        logger.debug("%s is reachable.", ip_address)
+        return True
+    except socket.timeout:
+        logger.debug("Connecting to %s:%s timed out.", ip_address, port)
         return False
-    except Exception as e:
-        logger.debug(f"An error occurred: {e}")
+    except OSError as e:
+        logger.debug("%s is unreachable: %s", ip_address, e)
         return False
 
+def resolve_host(host, ttl=DNS_TTL):
+    """gethostbyname with a TTL cache, so retries don't wait on the resolver."""
+    now = time.monotonic()
+    entry = _dns_cache.get(host)
+    if entry and now - entry[1] < ttl:
+        return entry[0]
+    ip = socket.gethostbyname(host)
+    _dns_cache[host] = (ip, now)
+    return ip
+
+def invalidate_dns_cache(host):
+    """Forget host's cached address, e.g. after a failed connect."""
+    _dns_cache.pop(host, None)
+
+def _probe(host, port):
+    # the timeout applies to this socket only, a process-wide default
+    # would also hit the MQTT client's sockets
+    ip = resolve_host(host)
+    try:
+        with socket.create_connection((ip, port), timeout=CHECK_INTERVAL):
+            return True
+    except OSError:
+        invalidate_dns_cache(host)  # the address may have moved, resolve again next time
+        raise
+
 def is_connected(host_site="www.google.com", port=80, debug=False):
     """
-    Check internet connectivity by attempting to connect to a host.
-    Default: Google DNS (8.8.8.8).
-    Returns True if connection succeeds, False otherwise.
+    Check internet connectivity by connecting to host_site. Only if that
+    fails are the PROBE_FALLBACK_TARGETS tried, at the same time; the first
+    success wins.
+    The answer is reused for CONNECTED_TTL, so callers polling in a loop
+    don't each open new connections.
+    Returns True if connected, False otherwise.
     """
-    try:
-        # DNS working?
-        host = socket.gethostbyname(host_site)
+    key = (host_site, port)
+    now = time.monotonic()
+    cached = _connected_cache.get(key)
+    if cached and now - cached[1] < CONNECTED_TTL:
+        return cached[0]
+    ok = _probe_any(host_site, port, debug)
+    _connected_cache[key] = (ok, time.monotonic())
+    return ok
 
-        # TCP connectivity working?
-        socket.setdefaulttimeout(CHECK_INTERVAL)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
+def _probe_any(host_site, port, debug):
+    try:
+        _probe(host_site, port)
         if debug:
             logger.debug("Internet connectivity check passed.")
         return True
-    
-    except Exception as e:
-        logger.error(f"Failed to connect to network: {e}")
-        return False
+    except OSError as e:
+        logger.debug("Connecting to %s:%s failed: %s, trying fallbacks", host_site, port, e)
+
+    futures = [_PROBE_EXECUTOR.submit(_probe, host, p) for host, p in PROBE_FALLBACK_TARGETS]
+    error = None
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=CHECK_INTERVAL + 1):
+            try:
+                future.result()
+            except OSError as e:
+                error = e
+                continue
+            if debug:
+                logger.debug("Internet connectivity check passed.")
+            return True
+    except concurrent.futures.TimeoutError as e:
+        error = e
+    finally:
+        for future in futures:
+            future.cancel()
+
+    logger.error(f"Failed to connect to network: {error}")
+    return False
 
 def wait_until_connected():
+    delay = 0.5
     while not is_connected():
-        logger.warn(f"No internet. Retrying in {CHECK_INTERVAL} sec...")
-        time.sleep(CHECK_INTERVAL)
+        logger.warn(f"No internet. Retrying in {delay} sec...")
+        time.sleep(delay)
+        delay = min(delay * 2, CHECK_INTERVAL)
 
 def get_local_ip():
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -12,6 +12,8 @@ import uuid
 import socket
 import concurrent.futures
 from azure.iot.device import IoTHubDeviceClient, Message
+import jsonutil
+import network
 
 # ----------------------------------------------------
 # CONFIGURATION
@@ -23,7 +25,6 @@ TELEMETRY_INTERVAL_SEC = 10.0
 # ----------------------------------------------------
 # NETWORK CHECK
 # ----------------------------------------------------
-
 def is_network_connected(host_site="www.google.com", port=80, timeout=1.5):
     """
     Check internet connectivity by attempting to connect to a host.
@@ -31,14 +32,16 @@ def is_network_connected(host_site="www.google.com", port=80, timeout=1.5):
     Returns True if connection succeeds, False otherwise.
     """
     try:
-        # DNS working?
-        host = socket.gethostbyname(host_site)
+        # DNS working? (cached, see network.resolve_host)
+        host = network.resolve_host(host_site)
 
-        # TCP connectivity working?
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
+        # TCP connectivity working? (timeout applies to this socket only)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect((host, port))
         return True
     except Exception as e:
+        network.invalidate_dns_cache(host_site)  # re-resolve next time, the address may be stale
         print("Failed to connect to network:", e)
         return False
 
@@ -55,22 +58,25 @@ def connect_to_network(max_retries=10, retry_interval=5):
     
  # ===================
 
+# one pool reused by every send; two workers so a send stuck past its
+# timeout does not hold up the next one
+_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
 def send_with_timeout(client, message, timeout_sec=5):
     print("Sending:", message)
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(client.send_message, message)
-        try:
-            future.result(timeout=timeout_sec)
-            print("Message sent successfully.")
-            return True
+    future = _EXECUTOR.submit(client.send_message, message)
+    try:
+        future.result(timeout=timeout_sec)
+        print("Message sent successfully.")
+        return True
 
-        except concurrent.futures.TimeoutError:
-            print(f"[ERROR] send_message timed out after {timeout_sec} sec")
-            return False
+    except concurrent.futures.TimeoutError:
+        print(f"[ERROR] send_message timed out after {timeout_sec} sec")
+        return False
 
-        except Exception as e:
-            print("[ERROR] send_message failed:", e)
-            return False
+    except Exception as e:
+        print("[ERROR] send_message failed:", e)
+        return False
         
 def create_iot_hub_client(conn_str):
     client = IoTHubDeviceClient.create_from_connection_string(conn_str)
@@ -101,7 +107,7 @@ def handle_c2d_message(message):
         body = message.data
         # If message is JSON, try to decode:
         try:
-            parsed = json.loads(body.decode('utf-8'))
+            parsed = jsonutil.loads(body)
             print(json.dumps(parsed, indent=2))
         except Exception:
             print(body)
@@ -120,23 +126,31 @@ def handle_c2d_message(message):
     except Exception as e:
         print("Error processing message:", e)
 
+def utc_timestamp():
+    # same output as strftime("%Y-%m-%dT%H:%M:%SZ") without the format parsing
+    t = time.gmtime()
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}T{t.tm_hour:02d}:{t.tm_min:02d}:{t.tm_sec:02d}Z"
+
 def create_telemetry():
     telemetry = {
         "deviceId": DEVICE_ID,
         "temperature": round(20 + 10 * (0.5 - time.time() % 1), 2),  # mock temperature
         "humidity": round(50 + 20 * (0.5 - time.time() % 1), 2),     # mock humidity
-        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-        "messageId": str(uuid.uuid4())
+        "timestamp": utc_timestamp(),
+        "messageId": uuid.uuid4().hex
     }
     return telemetry
 
+# fixed per-message metadata, built once and shared by every message
+CONTENT_TYPE = "application/json"
+CONTENT_ENCODING = "utf-8"
+_TEMPLATE_PROPS = {"sensorType": "mockSensor"}  # optional application properties
+
 def prepaere_message(telemetry):
-    # azure-iot-device Message wrapper
-    message = Message(json.dumps(telemetry))
-    message.content_type = "application/json"
-    message.content_encoding = "utf-8"
-    # optional: add application properties
-    message.custom_properties["sensorType"] = "mockSensor"
+    # azure-iot-device Message wrapper, only the body changes per message;
+    # the body is handed over as bytes so MQTT publishes it without re-encoding
+    message = Message(jsonutil.dumps_bytes(telemetry), content_encoding=CONTENT_ENCODING, content_type=CONTENT_TYPE)
+    message.custom_properties = dict(_TEMPLATE_PROPS)  # own copy, the SDK may add to it
     return message
 
 def send_telemetry(client, msg):
@@ -207,6 +221,7 @@ def main():
         print("Shutting down...")
 
     finally:
+        _EXECUTOR.shutdown(wait=False)
         client.disconnect()
         print("Disconnected.")
         print("Exiting.")
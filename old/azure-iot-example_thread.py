@@ -8,44 +8,150 @@ Simple Raspberry Pi device client for Azure IoT Hub:
 
 import time
 import json
-import uuid
 import socket
+import select
+import errno
+import os
 import concurrent.futures
-from azure.iot.device import ProvisioningDeviceClient, IoTHubDeviceClient, MethodResponse, Message
+# azure.iot.device (paho-mqtt, ssl, ...), yaml and slave (gpiod) are slow
+# to import, so they are imported where first used, not here
 import threading
-import queue
-import yaml
+import collections
+import random
+import heapq
+import jsonutil
+import network
 import logger # custom logger module
-from slave import Slave # custom slave module
 
 CONFIG_PATH = "config.yaml"
+CONFIG_CACHE_SUFFIX = ".cache.json"
 # Load configuration
 CONFIG = None
 
 # ----------------------------------------------------
 # GLOBALS
 # ----------------------------------------------------
-send_queue = queue.Queue()
-command_queue = queue.Queue()
+class SendQueue:
+    """
+    Light replacement for queue.Queue on the telemetry path: a deque plus
+    one Event that is set on every put. The consumer clears `wake` before
+    looking at the queue and then waits on it, so a put in between is never
+    missed. Entries carry a kind (index 4); at most one entry per non-None
+    kind is queued, a newer one only replaces the queued payload.
+    """
+    def __init__(self):
+        self._items = collections.deque()
+        self._by_kind = {}  # kind -> the queued entry of that kind
+        self._lock = threading.Lock()
+        self.wake = threading.Event()
+
+    def __len__(self):
+        return len(self._items)
+
+    def _release(self, item):
+        # called with _lock held once item leaves the queue
+        kind = item[4]
+        if kind is not None and self._by_kind.get(kind) is item:
+            del self._by_kind[kind]
+
+    def put(self, item):
+        """Append item, or coalesce it into the queued entry of its kind. False if coalesced."""
+        kind = item[4]
+        with self._lock:
+            if kind is not None:
+                queued = self._by_kind.get(kind)
+                if queued is not None:
+                    queued[1] = item[1]  # keeps its place in the queue
+                    if item[3] is not None:
+                        queued[3] = item[3]  # acking it now covers the newer record
+                    return False
+                self._by_kind[kind] = item
+            self._items.append(item)
+        self.wake.set()
+        return True
+
+    def put_front(self, items):
+        """Put items back at the front, keeping their order. Superseded kinds are skipped."""
+        with self._lock:
+            keep = []
+            for item in items:
+                kind = item[4]
+                if kind is not None:
+                    if kind in self._by_kind:
+                        continue  # a newer one of this kind is already queued
+                    self._by_kind[kind] = item
+                keep.append(item)
+            self._items.extendleft(reversed(keep))
+        self.wake.set()
+
+    def evict_oldest(self):
+        """Remove and return the oldest entry without a kind, None if there is none."""
+        with self._lock:
+            for i, item in enumerate(self._items):
+                if item[4] is None:
+                    del self._items[i]
+                    return item
+        return None
+
+    def min_pending_end(self):
+        """Smallest log end offset of the queued entries, None if none is persisted."""
+        with self._lock:
+            return min((item[3] for item in self._items if item[3] is not None), default=None)
+
+    def pop_many(self, max_items):
+        items = []
+        with self._lock:
+            while len(items) < max_items and self._items:
+                item = self._items.popleft()
+                self._release(item)
+                items.append(item)
+        return items
+
+SEND_QUEUE_MAXSIZE = 1024
+# entries are [msg_type, payload, attempts, wal_end_offset, kind]; telemetry
+# has kind None and may be evicted, heartbeat/MasterInfo are coalesced instead
+send_queue = SendQueue()
+stop_event = threading.Event()  # set once on shutdown to wake sleeping workers
+_CONNECTED = threading.Event()  # maintained by connection_watchdog_task
+DROPPED_MESSAGES = 0
+MAX_SEND_ATTEMPTS = 5
+MAX_SEND_BACKOFF_SEC = 60.0
+# queued messages are also appended to a log so they survive a power cycle
+UNSENT_LOG_PATH = "unsent.log"
+UNSENT_OFFSET_PATH = "unsent.offset"
+WAL_MAX_BYTES = 4_000_000
+WAL_SYNC_EVERY = 16  # fdatasync once per this many appends
+_wal = {"file": None, "appends": 0}
+_wal_lock = threading.Lock()
 MSGTYPE = ["telemetry", "propertyUpdate"]
+BATCH_MAX_ITEMS = 50
+BATCH_MAX_WAIT_SEC = 5.0
 
 client = None
-client_lock = threading.Lock()    
-STOP_HEARTBEAT = False
-
-SLAVE_READY_STATE = False
-ERROR_STATE = False
+_DISPATCH = {} # filled in by create_iot_hub_client
+SLAVE = None # created once in main, reused by every restart
+_slave_lock = threading.Lock() # one power cycle at a time
+WORKER_STACK_SIZE = 256 * 1024 # bytes, for the watchdog and worker threads
+# single long-lived worker used to bound the duration of every send
+_SEND_EXECUTOR = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="iot-send")
+# state shared between threads, Events so reads and writes are synchronized
+STOP_HEARTBEAT = threading.Event()
+SLAVE_READY_STATE = threading.Event()
+ERROR_STATE = threading.Event()
+_STATUS = ("Ready", "AwaitingSlave", "Error") # indexed by status()
 
 START_TIME = 0.0
 DEFAULT_TELEMETRY_INTERVAL_SEC = 10.0
 DEFAULT_CHECK_INTERVAL = 5.0
 DEFAULT_SEND_RETRY_INTERVAL = 5.0
+DEFAULT_PROBE_TIMEOUT = 1.0
 DEFAULT_HEARTBEAT_INTERVAL_SEC = 60.0
+MQTT_KEEP_ALIVE_SEC = 60
 DEFAULT_SLAVE_CONFIG = {"num": 0, "relay_gpio_line": 17, "power_off_delay_sec": 5.0}
 
 CONNECTION_CONFIG = {"device_id": "", "device_connection_string": ""}
 TELEMETRY_CONFIG = {"interval_sec": DEFAULT_TELEMETRY_INTERVAL_SEC, "heartbeat_interval_sec": DEFAULT_HEARTBEAT_INTERVAL_SEC}
-NETWORK_CONFIG = {"check_interval_sec": DEFAULT_CHECK_INTERVAL, "send_retry_interval_sec": DEFAULT_SEND_RETRY_INTERVAL}
+NETWORK_CONFIG = {"check_interval_sec": DEFAULT_CHECK_INTERVAL, "send_retry_interval_sec": DEFAULT_SEND_RETRY_INTERVAL, "probe_timeout_sec": DEFAULT_PROBE_TIMEOUT}
 SYS_CONFIG = {"log_to_file": True, "print_level": "info", "log_level": "info", "log_dir": "logs", "log_file_max_size_bytes": 1_000_000}
 HARDWARE_CONFIG = {"slave": DEFAULT_SLAVE_CONFIG}
 
@@ -53,24 +159,56 @@ HARDWARE_CONFIG = {"slave": DEFAULT_SLAVE_CONFIG}
 # change status
 # ----------------------------------------------------  
 def status():
-    global SLAVE_READY_STATE, ERROR_STATE
-    if ERROR_STATE:
-        return "Error"
-    elif not SLAVE_READY_STATE:
-        return "AwaitingSlave"
-    else:
-        return "Ready"
+    return _STATUS[2 if ERROR_STATE.is_set() else (0 if SLAVE_READY_STATE.is_set() else 1)]
 # ----------------------------------------------------
 # CONFIGURAION
 # ----------------------------------------------------
+def load_cached_config(cache_path, mtime):
+    """Return the config stored in the JSON sidecar if it was made from this mtime, else None."""
+    try:
+        with open(cache_path, "r") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cached, dict) or cached.get("_mtime") != mtime:
+        return None
+    return cached.get("data")
+
+def save_cached_config(cache_path, mtime, cfg):
+    try:
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"_mtime": mtime, "data": cfg}, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warn(f"Could not write config cache {cache_path}: {e}")
+
 def load_config(config_path=CONFIG_PATH):
+    """
+    Load the YAML config. The parsed result is kept in a JSON sidecar
+    (<config>.cache.json) keyed by the YAML file's mtime, so an unchanged
+    config is read with the much faster json parser.
+    """
+    cache_path = config_path + CONFIG_CACHE_SUFFIX
     try:
+        mtime = os.stat(config_path).st_mtime_ns
+        cfg = load_cached_config(cache_path, mtime)
+        if cfg is not None:
+            logger.info(f"Configuration loaded from {cache_path}")
+            return cfg
+        # only needed when the JSON cache is stale
+        import yaml
+        try:
+            from yaml import CSafeLoader as YamlLoader # libyaml-backed
+        except ImportError:
+            from yaml import SafeLoader as YamlLoader
         with open(config_path, "r") as f:
-            cfg = yaml.safe_load(f)
-            logger.info("Configuration loaded from {CONFIG_PATH}")
+            cfg = yaml.load(f, Loader=YamlLoader)
+            logger.info(f"Configuration loaded from {config_path}")
     except Exception as e:
         logger.error(f"Failed to load configuration: {e}")
         exit(1)
+    save_cached_config(cache_path, mtime, cfg)
     return cfg
 
 def parse_connection_config(config):
@@ -167,8 +305,14 @@ def parse_network_config(config):
         logger.warn(f"Invalid send retry interval {send_retry_interval}, using default {DEFAULT_SEND_RETRY_INTERVAL}")
         send_retry_interval = DEFAULT_SEND_RETRY_INTERVAL
     
+    probe_timeout = network_config.get("probe_timeout_sec", DEFAULT_PROBE_TIMEOUT)
+    if probe_timeout <= 0:
+        logger.warn(f"Invalid probe timeout {probe_timeout}, using default {DEFAULT_PROBE_TIMEOUT}")
+        probe_timeout = DEFAULT_PROBE_TIMEOUT
+    
     NETWORK_CONFIG["check_interval_sec"] = check_interval
-    NETWORK_CONFIG["send_retry_interval_sec"] = send_retry_interval                     
+    NETWORK_CONFIG["send_retry_interval_sec"] = send_retry_interval
+    NETWORK_CONFIG["probe_timeout_sec"] = probe_timeout                     
     logger.debug(f"Network configuration parsed: {NETWORK_CONFIG}") 
 
 def parse_system_config(config):
@@ -242,53 +386,105 @@ def apply_system_config():
 # ----------------------------------------------------
 # NETWORK CHECK
 # ----------------------------------------------------
+ROUTE_PROBE_ADDR = ("8.8.8.8", 53)
+
+def has_route(addr=ROUTE_PROBE_ADDR):
+    """
+    Ask the kernel whether addr is routable. connect() on a UDP socket only
+    does the routing-table lookup: no packet is sent and it never blocks.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(addr)
+        return True
+    except OSError:
+        return False
 
-def is_network_connected(host_site="www.google.com", port=80, timeout=NETWORK_CONFIG["check_interval_sec"]):
+def is_network_connected(host_site="www.google.com", port=80, timeout=None):
     """
     Check internet connectivity by attempting to connect to a host.
     Default: Google DNS (8.8.8.8).
     Returns True if connection succeeds, False otherwise.
+    The connect is non-blocking and bounded by `timeout`, so a flaky link
+    cannot stall the caller on the kernel's TCP retransmit backoff.
+    timeout defaults to the configured probe_timeout_sec.
     """
+    if timeout is None:
+        timeout = NETWORK_CONFIG["probe_timeout_sec"]
+    # no route at all (interface down, no DHCP lease yet): fail without
+    # waiting on DNS or a TCP timeout
+    if not has_route():
+        logger.error("Failed to connect to network: no route to host")
+        return False
     try:
-        # DNS working?
-        host = socket.gethostbyname(host_site)
+        # DNS working? (cached, see network.resolve_host)
+        host = network.resolve_host(host_site)
 
         # TCP connectivity working?
-        socket.setdefaulttimeout(timeout)
-        socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setblocking(False)
+            if hasattr(socket, "TCP_USER_TIMEOUT"):  # Linux only
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT, int(timeout * 1000))
+            err = s.connect_ex((host, port))
+            if err not in (0, errno.EINPROGRESS):
+                raise OSError(err, os.strerror(err))
+            _, writable, _ = select.select([], [s], [], timeout)
+            if not writable:
+                raise TimeoutError(f"connect to {host}:{port} timed out after {timeout} sec")
+            err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if err != 0:
+                raise OSError(err, os.strerror(err))
         return True
     except Exception as e:
+        network.invalidate_dns_cache(host_site)  # re-resolve on the next probe
         logger.error(f"Failed to connect to network: {e}")
         return False
     
 # ----------------------------------------------------
 # IOT HUB
 # ----------------------------------------------------
-def send_with_timeout(client, message, timeout_sec=NETWORK_CONFIG["send_retry_interval_sec"]):
-    if message is None:
-        logger.error("No message to send.")
-        return True  # nothing to send
-    logger.debug(f"Sending: {message}")
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        if message[0] == MSGTYPE[0]:  # telemetry
-            future = executor.submit(client.send_message, message[1])
-        elif message[0] == MSGTYPE[1]:  # propertyUpdate
-            properties_payload = {"IP": "192.168.0.1"}
-            future = executor.submit(client.patch_twin_reported_properties, message[1])
-        
+def _send_messages(client, outgoing):
+    """
+    Runs on the send executor: send every (message, originals) pair in
+    order and return the originals of the ones that failed.
+    """
+    from azure.iot.device.exceptions import OperationTimeout
+    dispatch = _DISPATCH  # type -> bound client method, resolved once per client
+    failed = []
+    for message, originals in outgoing:
         try:
-            future.result(timeout=timeout_sec)
+            dispatch[message[0]](message[1])
             logger.info("Message sent successfully.")
-            return True
 
-        except concurrent.futures.TimeoutError as exc:
-            logger.error(f"send_message timed out: {exc} after {timeout_sec} sec")
-            return False
+        except OperationTimeout as exc:
+            logger.error(f"send_message timed out: {exc}")
+            failed.extend(originals)
 
         except Exception as e:
             logger.error(f"send_message failed: {e}")
-            return False
+            failed.extend(originals)
+    return failed
+
+def send_with_timeout(client, outgoing, timeout_sec=None):
+    """
+    Send a list of (message, originals) pairs with a single hop to the send
+    executor, allowing timeout_sec per message. Returns the original
+    messages that were not sent.
+    """
+    if timeout_sec is None:
+        timeout_sec = NETWORK_CONFIG["send_retry_interval_sec"]
+    if not outgoing:
+        logger.error("No message to send.")
+        return []  # nothing to send
+    logger.debug("Sending: %s", outgoing)
+
+    future = _SEND_EXECUTOR.submit(_send_messages, client, outgoing)
+    try:
+        return future.result(timeout=timeout_sec * len(outgoing))
+
+    except concurrent.futures.TimeoutError as exc:
+        logger.error(f"send_message timed out: {exc} after {timeout_sec * len(outgoing)} sec")
+        return [msg for _, originals in outgoing for msg in originals]
         
 # =========================================================
 def create_connection_str_from_dps(device_id, id_scope, symmetric_key):
@@ -299,6 +495,7 @@ def create_connection_str_from_dps(device_id, id_scope, symmetric_key):
     logger.info("Registering device with DPS...")
 
     # 1) Connect to DPS
+    from azure.iot.device import ProvisioningDeviceClient
     provisioning_client = ProvisioningDeviceClient.create_from_symmetric_key(
         provisioning_host="global.azure-devices-provisioning.net",
         registration_id=device_id,
@@ -329,24 +526,38 @@ def create_connection_str_from_dps(device_id, id_scope, symmetric_key):
         
 def create_iot_hub_client(conn_str):
     logger.info("Creating new IoTHubDeviceClient...")
-    client = IoTHubDeviceClient.create_from_connection_string(conn_str)
+    from azure.iot.device import IoTHubDeviceClient
+    # Keep the MQTT connection alive and let the SDK reconnect by itself
+    # (with backoff) instead of re-handshaking from the send path.
+    client = IoTHubDeviceClient.create_from_connection_string(
+        conn_str,
+        keep_alive=MQTT_KEEP_ALIVE_SEC,
+        connection_retry=True,
+        connection_retry_interval=int(NETWORK_CONFIG["check_interval_sec"]),
+        websockets=False,
+    )
+    # Handlers are plain (sync) callables run on the SDK's handler thread;
+    # bind them once here rather than on every (re)connect.
+    client.on_message_received = handle_c2d_message
+    client.on_method_request_received = command_handler
+    # message type -> bound send method, used by _send_messages
+    _DISPATCH[MSGTYPE[0]] = client.send_message
+    _DISPATCH[MSGTYPE[1]] = client.patch_twin_reported_properties
     return client
 
 def connect_to_iot_hub(client):
-    with client_lock:
-        if not client.connected:
-            try:
-                logger.info("Connecting to Azure IoT Hub...")
-                client.connect()
-                logger.info("Successfully connected to IoT Hub.")
-
-            except Exception as e:
-                logger.error(f"Azure connect failed: {e}")
-                time.sleep(retry_interval)
-        
-    # Set up C2D message handler
-    client.on_message_received = handle_c2d_message
-    client.on_method_request_received = command_handler
+    # called from main before the workers start, then only from the
+    # watchdog thread, so no lock is needed
+    if not client.connected:
+        try:
+            logger.info("Connecting to Azure IoT Hub...")
+            client.connect()
+            logger.info("Successfully connected to IoT Hub.")
+
+        except Exception as e:
+            logger.error(f"Azure connect failed: {e}")
+            return False
+
     return True
 
 def handle_c2d_message(message):
@@ -356,9 +567,9 @@ def handle_c2d_message(message):
         body = message.data
         # If message is JSON, try to decode:
         try:
-            parsed = json.loads(body.decode('utf-8'))
-            logger.debug(f"message: {json.dumps(parsed, indent=2)}")
-        except Exception:
+            parsed = jsonutil.loads(body)
+            logger.debug("message: %s", parsed)
+        except Exception as e:
             logger.error(f"failed parsing message as JSON: {e}")
         
         # You can also read custom properties:
@@ -380,11 +591,13 @@ def handle_c2d_message(message):
 def command_handler(method_request):
     """
     Handler for incoming direct methods (commands).
+    Runs on the SDK's handler thread, which is free to block briefly, so the
+    command is processed and answered here; long work (restart) gets its
+    own thread in the command itself.
     """
     logger.info(f"Received command: {method_request.name}")
     logger.debug(f"Received command {method_request.name} with payload {method_request.payload}")
-    # Push the request to the queue
-    command_queue.put(method_request)
+    process_command(client, method_request)
 
 # def prepaere_message(telemetry):
 #     # azure-iot-device Message wrapper
@@ -397,60 +610,70 @@ def command_handler(method_request):
 # ----------------------------------------------------
 # creating messages
 # ----------------------------------------------------
-def create_heartbeat():
-    payload = {
-        "status": status(),
-    }
+def _resolve_local_ip():
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return "127.0.0.1"
 
-    msg = Message(json.dumps(payload))
-    # msg.custom_properties["$.sub"] = "Heartbeat"  # Component name
-    return msg
+# resolved once at startup, the hostname lookup can block on some resolvers
+_LOCAL_IP = _resolve_local_ip()
+
+# Telemetry payloads are queued already serialized: only a couple of
+# fields change per sample, so they are filled into fixed JSON templates.
+_HEARTBEAT_TMPL = '{"status":"%s"}'
+_TELEMETRY_TMPL = '{"temperature":%.2f,"humidity":%.2f}'
+
+def create_heartbeat():
+    return _HEARTBEAT_TMPL % status()
 
 def create_telemetry():
-    payload = {
-        "temperature": round(20 + 10 * (0.5 - time.time() % 1), 2),  # mock temperature
-        "humidity": round(50 + 20 * (0.5 - time.time() % 1), 2),     # mock humidity
-    }
-    msg = Message(json.dumps(payload))
+    phase = 0.5 - time.time() % 1
+    return _TELEMETRY_TMPL % (20 + 10 * phase,  # mock temperature
+                              50 + 20 * phase)  # mock humidity
+
+def prepare_message(payload):
+    """Wrap one serialized telemetry payload into a D2C message."""
+    from azure.iot.device import Message
+    msg = Message(payload)
+    msg.content_type = "application/json"
+    msg.content_encoding = "utf-8"
     return msg
 
+# PnP convention requires wrapping component properties in a dictionary 
+# with specific metadata fields: __t ("timestamp" or "type")
+# payload = {
+#     "MasterInfo": {
+#         "__t": "c",  # indicates component
+#         "id": int(111),
+#         "ip": str(socket.gethostbyname(socket.gethostname())),
+#         "name": "iot-device-001",
+#     }
+# }
+# nothing in it changes at runtime, so it is built once
+_MASTER_INFO = {
+    "id": int(111),
+    "ip": _LOCAL_IP,
+    "name": "iot-device-001",
+}
+
 def create_master_info_msg():
-    # global START_TIME
-    # PnP convention requires wrapping component properties in a dictionary 
-    # with specific metadata fields: __t ("timestamp" or "type")
-    # payload = {
-    #     "MasterInfo": {
-    #         "__t": "c",  # indicates component
-    #         "id": int(111),
-    #         "ip": str(socket.gethostbyname(socket.gethostname())),
-    #         "name": "iot-device-001",
-    #     }
-    # }
-    payload = {
-        "id": int(111),
-        "ip": str(socket.gethostbyname(socket.gethostname())),
-        "name": "iot-device-001",
-    }
-    return payload
+    return _MASTER_INFO
 
 # ======================================================
-# COMMAND PROCESSOR THREAD
+# COMMAND PROCESSING
 # ======================================================
 def restart_slave_task(delay_sec):
-    global SLAVE_READY_STATE
     if delay_sec is None or delay_sec < 0:
         delay_sec = 0
     logger.debug(f"Restarting slave will start in {delay_sec} seconds...")
-    SLAVE_READY_STATE = False
+    SLAVE_READY_STATE.clear()
     time.sleep(delay_sec)
     
-    Slave(
-        relay_gpio_line=HARDWARE_CONFIG["slave"]["relay_gpio_line"],
-        num=HARDWARE_CONFIG["slave"]["num"],
-        debug=False
-    ).power_cycle(off_duration=HARDWARE_CONFIG["slave"]["power_off_delay_sec"])
+    with _slave_lock:
+        SLAVE.power_cycle(off_duration=HARDWARE_CONFIG["slave"]["power_off_delay_sec"])
     
-    SLAVE_READY_STATE = True
+    SLAVE_READY_STATE.set()
     logger.debug("Slave restarted and ready.")
     
 def restart_cmd(cmd_payload):
@@ -461,119 +684,314 @@ def restart_cmd(cmd_payload):
     threading.Thread(target=restart_slave_task, args=(delay, )).start()
     return "restarted", 200
 
-def command_processor_task(client, running_event):
+def process_command(client, cmd_request):
+    cmd_name = cmd_request.name
+    payload = cmd_request.payload
+    logger.debug(f"processing command {cmd_name} and payload {payload}")
 
-    logger.info("Command processor ready...")
+    try:
+        # COMMAND ROUTING
+        
+        if cmd_name == "restart":
+            status, code = restart_cmd(payload)
 
-    while running_event.is_set():
-        cmd_request = command_queue.get()  # waits automatically
+        # elif cmd_name == "getStatus":
+        #     response_payload = {
+        #         "status": "running",
+        #         "cpuTemp": 46.3,
+        #         "code": 200
+        #     }
+        #     status_code = 200
+
+        else:
+            logger.warn(f"Unknown command {cmd_name}")
+            status, code = "Unknown command", 404
+
+    except Exception as e:
+        logger.error(f"Processing error: {e}")
+        status, code = "error", 500
+
+    # SEND COMMAND RESPONSE
+    response_payload = {"status": status, "code": code}
+    from azure.iot.device import MethodResponse
+    response = MethodResponse.create_from_method_request(
+        cmd_request,
+        code,
+        response_payload
+    )
+    client.send_method_response(response)
 
-        cmd_name = cmd_request.name
-        payload = cmd_request.payload
-        logger.debug(f"processing command {cmd_name} and payload {payload}")
+    logger.info(f"[CMD] Completed command {cmd_name}")
 
+# ----------------------------------------------------
+# SEND QUEUE
+# ----------------------------------------------------
+def wal_open():
+    """
+    Open the unsent-message log and replay every record written after the
+    last acknowledged offset into the send queue. A torn record at the end
+    (power loss mid-write) is cut off.
+    """
+    acked = 0
+    if os.path.exists(UNSENT_OFFSET_PATH):
         try:
-            # COMMAND ROUTING
-            
-            if cmd_name == "restart":
-                status, code = restart_cmd(payload)
+            with open(UNSENT_OFFSET_PATH, "r") as f:
+                acked = int(f.read().strip() or 0)
+        except (OSError, ValueError) as e:
+            logger.warn(f"Could not read {UNSENT_OFFSET_PATH}: {e}")
 
-            # elif cmd_name == "getStatus":
-            #     response_payload = {
-            #         "status": "running",
-            #         "cpuTemp": 46.3,
-            #         "code": 200
-            #     }
-            #     status_code = 200
+    end = 0
+    replayed = 0
+    if os.path.exists(UNSENT_LOG_PATH):
+        with open(UNSENT_LOG_PATH, "rb") as f:
+            if acked > os.path.getsize(UNSENT_LOG_PATH):
+                acked = 0  # offset belongs to an older log
+            f.seek(acked)
+            end = acked
+            while True:
+                header = f.read(4)
+                if len(header) < 4:
+                    break
+                size = int.from_bytes(header, "big")
+                body = f.read(size)
+                if len(body) < size:
+                    break
+                end = f.tell()
+                record = jsonutil.loads(body)
+                kind = record[2] if len(record) > 2 else None  # older logs have no kind
+                send_queue.put([record[0], record[1], 0, end, kind])
+                replayed += 1
+        os.truncate(UNSENT_LOG_PATH, end)
 
-            else:
-                logger.warn(f"Unknown command {cmd_name}")
-                status, code = "Unknown command", 404
+    _wal["file"] = open(UNSENT_LOG_PATH, "ab")
+    if replayed:
+        logger.info(f"Replayed {replayed} unsent message(s) from {UNSENT_LOG_PATH}")
 
-        except Exception as e:
-            logger.error(f"Processing error: {e}")
-            status, code = "error", 500
-
-        # SEND COMMAND RESPONSE
-        response_payload = {"status": status, "code": code}
-        response = MethodResponse.create_from_method_request(
-            cmd_request,
-            code,
-            response_payload
-        )
-        client.send_method_response(response)
+def wal_append(message, kind=None):
+    """Append message and its kind to the unsent-message log, return its end offset (None if not persisted)."""
+    f = _wal["file"]
+    if f is None:
+        return None
+    body = jsonutil.dumps_bytes([message[0], message[1], kind])
+    if f.tell() + 4 + len(body) > WAL_MAX_BYTES:
+        logger.warn(f"{UNSENT_LOG_PATH} is full, message kept in memory only")
+        return None
+    f.write(len(body).to_bytes(4, "big") + body)
+    f.flush()
+    _wal["appends"] += 1
+    if _wal["appends"] % WAL_SYNC_EVERY == 0:
+        os.fdatasync(f.fileno())  # batched, not per message
+    return f.tell()
 
-        logger.info(f"[CMD] Completed command {cmd_name}")
+def wal_ack(end):
+    """Mark everything up to end as sent; truncate the log once it is fully acknowledged."""
+    if end is None:
+        return
+    with _wal_lock:
+        f = _wal["file"]
+        if f is None:
+            return
+        if end >= f.tell() and not send_queue:
+            f.seek(0)
+            f.truncate()
+            end = 0
+        with open(UNSENT_OFFSET_PATH, "w") as off:
+            off.write(str(end))
 
-# ----------------------------------------------------
-# SENDER TASK THREAD
-# ----------------------------------------------------
-def sender_task(client, running_event):
-    while running_event.is_set():
-        msg = send_queue.get()  # blocking wait for next message
-
-        # Wait until internet is available
-        while not is_network_connected():
-            logger.warn(f"No internet. Retrying in {NETWORK_CONFIG["check_interval_sec"]} sec...")
-            time.sleep(NETWORK_CONFIG["check_interval_sec"])
-
-        # Ensure Azure client is connected
-        if not connect_to_iot_hub(client):
-            logger.warn("Will retry sending message later...")
-            time.sleep(NETWORK_CONFIG["check_interval_sec"])
-            send_queue.put(msg)  # Put back into queue
-            continue
+def wal_close():
+    f = _wal["file"]
+    if f is not None:
+        with _wal_lock:
+            f.flush()
+            os.fdatasync(f.fileno())
+            f.close()
+            _wal["file"] = None
 
-        # Try sending the message
-        try:
-            send_with_timeout(client, msg)
-            
-        except Exception as e:
-            logger.error(f"send_message failed: {e}")
-            logger.warn("Retrying later...")
-            send_queue.put(msg)
-            time.sleep(NETWORK_CONFIG["send_retry_interval_sec"])
+def enqueue(message, kind=None):
+    """
+    Persist a message to the unsent-message log and put it on the bounded
+    send queue. Messages with a kind (heartbeat, MasterInfo) are never
+    dropped; a newer one replaces the queued payload of its kind. When the
+    queue is full the oldest telemetry message is dropped to make room.
+    """
+    global DROPPED_MESSAGES
+    with _wal_lock:  # keeps queue order identical to log order
+        message.append(wal_append(message, kind))
+        message.append(kind)
+        if kind is not None:
+            if not send_queue.put(message):
+                return  # coalesced, the queue did not grow
+            full = len(send_queue) > SEND_QUEUE_MAXSIZE
+        else:
+            full = len(send_queue) >= SEND_QUEUE_MAXSIZE
+        if full and send_queue.evict_oldest() is not None:
+            DROPPED_MESSAGES += 1
+            logger.warn(f"Send queue full, dropped oldest telemetry message ({DROPPED_MESSAGES} dropped so far)")
+        if kind is None:
+            send_queue.put(message)
 
-        time.sleep(0.1)  # prevent CPU spin
-    
-    logger.info("Sender worker thread exiting...")
+def take_batch(max_items=BATCH_MAX_ITEMS):
+    """Pop up to max_items messages off the front of the send queue."""
+    return send_queue.pop_many(max_items)
+
+def batch_ack_end(batch):
+    """
+    Log offset that can be acknowledged once batch is sent: its largest end
+    offset that still lies before every queued record. A coalesced entry
+    points at its newest record, so a sent batch may end past messages
+    that are still queued.
+    """
+    pending = send_queue.min_pending_end()
+    ends = [msg[3] for msg in batch if msg[3] is not None]
+    if pending is not None:
+        ends = [end for end in ends if end < pending]
+    return max(ends, default=None)
+
+def send_batch(client, batch):
+    """
+    Send every message of a batch on its own, in one executor call. Each
+    telemetry payload is its own D2C message, the hub does not split JSON
+    arrays over MQTT. Returns the messages that could not be sent.
+    """
+    outgoing = []
+    for msg in batch:
+        if msg[0] == MSGTYPE[0]:
+            outgoing.append(([MSGTYPE[0], prepare_message(msg[1])], [msg]))
+        else:
+            outgoing.append((msg, [msg]))
+
+    return send_with_timeout(client, outgoing)
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, capped at MAX_SEND_BACKOFF_SEC."""
+    base = NETWORK_CONFIG["send_retry_interval_sec"]
+    return min(MAX_SEND_BACKOFF_SEC, base * 2 ** (attempts - 1)) + random.uniform(0, base)
+
+def requeue_failed(failed):
+    """
+    Count one more attempt for each failed message and put it back at the
+    front of the queue (keeping log order), or drop it after MAX_SEND_ATTEMPTS.
+    """
+    global DROPPED_MESSAGES
+    retry = []
+    for msg in failed:
+        msg[2] += 1
+        if msg[2] >= MAX_SEND_ATTEMPTS:
+            DROPPED_MESSAGES += 1
+            logger.warn(f"Dropping message after {msg[2]} failed attempts ({DROPPED_MESSAGES} dropped so far)")
+            continue
+        retry.append(msg)
+    send_queue.put_front(retry)
 
 # ----------------------------------------------------
-# SENSOR TASK THREAD – RUNS AT ITS OWN SPEED
+# CONNECTION WATCHDOG THREAD
 # ----------------------------------------------------
-def sensor_task(running_event):
-    last_time = 0
+def connection_watchdog_task(client, running_event):
+    """
+    Probe the network and the hub connection every check interval and keep
+    _CONNECTED in sync, reconnecting the client if the SDK gave up. The
+    sender only waits on _CONNECTED instead of probing per batch.
+    """
     while running_event.is_set():
-        now = time.time()
-        if now - last_time >= TELEMETRY_CONFIG["interval_sec"]:
-            last_time = now
-            payload = create_telemetry()
-            # payload = prepaere_message(message)
-            send_queue.put([MSGTYPE[0], payload])
-            logger.debug("Queuing message: {payload}")
-        time.sleep(0.1)
+        if is_network_connected() and (client.connected or connect_to_iot_hub(client)):
+            _CONNECTED.set()
+        else:
+            _CONNECTED.clear()
+        if stop_event.wait(timeout=NETWORK_CONFIG["check_interval_sec"]):
+            break
 
 # ----------------------------------------------------
-# HEARTBEAT TASK THREAD – DIFFERENT RATE
+# WORKER THREAD – TELEMETRY/HEARTBEAT TIMERS AND SENDING
 # ----------------------------------------------------
-def heartbeat_task(running_event):
-    last_time = 0
-    while running_event.is_set():
-        now = time.time()
-        if not STOP_HEARTBEAT:
-            if now - last_time >= TELEMETRY_CONFIG["heartbeat_interval_sec"]:
-                last_time = now
-                message = create_heartbeat()
-                # payload = prepaere_message(message)
-                send_queue.put([MSGTYPE[0], message])
-                logger.debug("Queuing message: {message}")
-        time.sleep(0.1)
+def emit_telemetry():
+    """Queue one telemetry sample, return the delay until the next one."""
+    payload = create_telemetry()
+    enqueue([MSGTYPE[0], payload, 0])
+    logger.debug("Queuing message: %s", payload)
+    return TELEMETRY_CONFIG["interval_sec"]
+
+def emit_heartbeat():
+    if not STOP_HEARTBEAT.is_set():
+        message = create_heartbeat()
+        enqueue([MSGTYPE[0], message, 0], kind="heartbeat")
+        logger.debug("Queuing message: %s", message)
+    return TELEMETRY_CONFIG["heartbeat_interval_sec"]
+
+def worker_task(client, running_event):
+    """
+    One thread for the timers and the sender. Telemetry and heartbeat are
+    deadlines on a heap; a batch is sent once it is full or BATCH_MAX_WAIT_SEC
+    after its first message, and a failed send pushes the next attempt out
+    by the backoff delay. Between those the thread sleeps on send_queue.wake until
+    the nearest deadline.
+    """
+    # bind hot-path lookups once, the loop below runs per event
+    check_iv = NETWORK_CONFIG["check_interval_sec"]
+    connected = _CONNECTED
+    wake = send_queue.wake
+    queue_ = send_queue
+    monotonic = time.monotonic
+
+    now = monotonic()
+    timers = [(now, 0, emit_telemetry), (now, 1, emit_heartbeat)]
+    batch_deadline = None  # set when the first message of a batch shows up
+    retry_at = 0.0
+
+    while running_event.is_set() and not stop_event.is_set():
+        wake.clear()  # anything queued from here on wakes the wait below
+        now = monotonic()
+
+        # Fire due timers, each returns the delay until its next run
+        while timers[0][0] <= now:
+            deadline, seq, emit = heapq.heappop(timers)
+            deadline += emit()
+            if deadline < now:
+                deadline = now  # fell behind, don't burst
+            heapq.heappush(timers, (deadline, seq, emit))
+
+        if queue_ and batch_deadline is None:
+            batch_deadline = now + BATCH_MAX_WAIT_SEC
+        wake_at = timers[0][0]
+
+        if batch_deadline is not None:
+            send_at = max(retry_at, batch_deadline if len(queue_) < BATCH_MAX_ITEMS else now)
+            if send_at > now:
+                wake_at = min(wake_at, send_at)
+            elif not connected.is_set():
+                # the watchdog owns reconnects, just look again later
+                logger.warn(f"Not connected. Retrying in {check_iv} sec...")
+                wake_at = min(wake_at, now + check_iv)
+            else:
+                batch = take_batch()
+                batch_deadline = None
+                # reconnecting is left to the SDK and the watchdog
+                failed = send_batch(client, batch)
+                if failed:
+                    requeue_failed(failed)
+                    delay = retry_delay(max(msg[2] for msg in failed))
+                    logger.warn(f"Retrying {len(failed)} message(s) in {delay:.1f} sec...")
+                    retry_at = monotonic() + delay
+                else:
+                    wal_ack(batch_ack_end(batch))
+                continue  # the send took time, re-check the timers
+
+        wake.wait(timeout=max(0.0, wake_at - monotonic()))
+
+    logger.info("Worker thread exiting...")
 
 # ----------------------------------------------------
 # MAIN
 # ----------------------------------------------------
+def create_slave():
+    from slave import Slave # custom slave module, pulls in gpiod
+    return Slave(
+        relay_gpio_line=HARDWARE_CONFIG["slave"]["relay_gpio_line"],
+        num=HARDWARE_CONFIG["slave"]["num"],
+        debug=False
+    )
+
 def main():
-    global START_TIME
+    global START_TIME, client, SLAVE
     START_TIME = time.time()
     logger.debug("Starting Azure IoT device client at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(START_TIME))}")
     
@@ -585,6 +1003,8 @@ def main():
     parse_system_config(config)
     parse_hardware_config(config)
     apply_system_config()
+    SLAVE = create_slave()
+    wal_open()
 
     if not is_network_connected():
         logger.error("Could not connect to network.")
@@ -602,24 +1022,25 @@ def main():
     running = threading.Event()
     running.set()
     # create threads
-    sender_worker = threading.Thread(target=sender_task, args=(client, running), daemon=True)
-    sensor_worker = threading.Thread(target=sensor_task, args=(running,), daemon=True)
-    heartbeat_worker = threading.Thread(target=heartbeat_task, args=(running,), daemon=True)
-    command_processor_worker = threading.Thread(target=command_processor_task, args=(client, running,), daemon=True)
+    watchdog_worker = threading.Thread(target=connection_watchdog_task, args=(client, running), name="watchdog", daemon=True)
+    worker = threading.Thread(target=worker_task, args=(client, running), name="worker", daemon=True)
+
+    # start threads; neither recurses, so a small stack instead of the 8 MiB
+    # default (the size is taken at start(), then restored for later threads)
+    _CONNECTED.set()  # just connected above
+    default_stack = threading.stack_size(WORKER_STACK_SIZE)
+    try:
+        watchdog_worker.start()
+        worker.start()
+    finally:
+        threading.stack_size(default_stack)
 
-    # start threads
-    sender_worker.start()
-    sensor_worker.start()
-    heartbeat_worker.start()
-    command_processor_worker.start()
-    
-    unsent_queue = []   # store unsent messages safely
 
     try:
         # Send initial MasterInfo property update
         msg = create_master_info_msg()
-        logger.debug("Queuing message: {message}")
-        send_queue.put([MSGTYPE[1], msg])
+        logger.debug("Queuing message: %s", msg)
+        enqueue([MSGTYPE[1], msg, 0], kind="master_info")
             
         while True:
             time.sleep(1)
@@ -629,11 +1050,13 @@ def main():
         
     finally:
         running.clear()
+        stop_event.set()
+        send_queue.wake.set()  # let the worker leave its wait right away
         logger.close_logger()
-        # sender_worker.join(timeout=2)
-        # sensor_worker.join(timeout=1)
-        # heartbeat_worker.join(timeout=1)
-        time.sleep(2)  # wait for sender thread to exit
+        # worker.join(timeout=2)
+        time.sleep(2)  # wait for worker thread to exit
+        _SEND_EXECUTOR.shutdown(wait=False)
+        wal_close()
         client.disconnect()
         logger.info("Disconnected.")
         logger.info("Exiting.")
@@ -0,0 +1,22 @@
+import os
+import sys
+import time
+from ringlog import RingLog
+
+# Print a ring log written by `socket_sniffer.py --ring` as text lines.
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else "socket.ringlog"
+    if not os.path.exists(path):
+        sys.exit(f"{path}: no such ring log")
+    ring = RingLog(path, os.path.getsize(path))  # never resize an existing log
+    try:
+        for ts_ns, payload in ring.records():
+            sec, ns = divmod(ts_ns, 1_000_000_000)
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+            print(f"[{stamp}.{ns // 1_000_000:03d}] {payload.decode('utf-8', errors='replace')}")
+    finally:
+        ring.close()
+
+if __name__ == "__main__":
+    main()
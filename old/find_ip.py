@@ -12,6 +12,16 @@ VENDOR_OUIS = {
     "00:01:A9",  # replace with known vendor OUI(s)
 }
 
+# -----------------------------
+# Regexes, compiled once at import
+# -----------------------------
+_IFACE_RE = re.compile(r"\bdev\s+(\S+)")
+_CIDR_RE = re.compile(r"\binet\s+(\d+\.\d+\.\d+\.\d+/\d+)\b")
+_REPORT_RE = re.compile(r"Nmap scan report for\s+(.+)$")
+_REPORT_IP_RE = re.compile(r"\((\d+\.\d+\.\d+\.\d+)\)$")
+_LLADDR_RE = re.compile(r"lladdr\s+([0-9a-fA-F:]{17})")
+_MAC_RE = re.compile(r"([0-9a-fA-F:]{17})")
+
 # -----------------------------
 # Helpers
 # -----------------------------
@@ -31,7 +41,7 @@ def get_default_iface() -> Optional[str]:
     except Exception:
         return None
 
-    m = re.search(r"\bdev\s+(\S+)", out)
+    m = _IFACE_RE.search(out)
     return m.group(1) if m else None
 
 def get_iface_cidr(iface: str) -> Optional[str]:
@@ -46,7 +56,7 @@ def get_iface_cidr(iface: str) -> Optional[str]:
     except Exception:
         return None
 
-    m = re.search(r"\binet\s+(\d+\.\d+\.\d+\.\d+/\d+)\b", out)
+    m = _CIDR_RE.search(out)
     return m.group(1) if m else None
 
 def get_subnet_from_default_route() -> Tuple[str, str, str]:
@@ -79,10 +89,10 @@ def parse_nmap_443_state(nmap_output: str):
     for line in nmap_output.splitlines():
         line = line.strip()
 
-        m = re.search(r"Nmap scan report for\s+(.+)$", line)
+        m = _REPORT_RE.search(line)
         if m:
             host = m.group(1)
-            ip_match = re.search(r"\((\d+\.\d+\.\d+\.\d+)\)$", host)
+            ip_match = _REPORT_IP_RE.search(host)
             current_ip = ip_match.group(1) if ip_match else host
             continue
 
@@ -101,7 +111,7 @@ def get_mac_from_ip_neigh(ip: str) -> Optional[str]:
     except Exception:
         return None
 
-    m = re.search(r"lladdr\s+([0-9a-fA-F:]{17})", out)
+    m = _LLADDR_RE.search(out)
     return m.group(1).upper() if m else None
 
 def get_mac_from_arp(ip: str) -> Optional[str]:
@@ -110,7 +120,7 @@ def get_mac_from_arp(ip: str) -> Optional[str]:
     except Exception:
         return None
 
-    m = re.search(r"([0-9a-fA-F:]{17})", out)
+    m = _MAC_RE.search(out)
     return m.group(1).upper() if m else None
 
 def get_mac(ip: str) -> Optional[str]:
@@ -1,31 +1,66 @@
 import serial
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 PORT = "/dev/ttyUSB0"
+ADAPTERS = [PORT]  # one port can only be opened once, so probes run in parallel per adapter
+RETRY_DELAY_SEC = 2.0
 
 baud_rates = [57600] #[9600, 19200, 38400, 57600, 115200]
 parities = [serial.PARITY_EVEN]  # [serial.PARITY_NONE, serial.PARITY_EVEN, serial.PARITY_ODD]
 stopbits = [serial.STOPBITS_TWO]
 
-print("Starting auto-detect...\n")
+def probe(port, baud, parity, sb):
+    """Return a non-empty, non-zero sample read with these settings, else None."""
+    print(f"[{port}] Testing {baud} baud, parity={parity}, stopbits={sb}")
+    try:
+        # the port is closed on every path, also when read() raises
+        with serial.Serial(port, baud, timeout=0.5, parity=parity, stopbits=sb) as ser:
+            data = ser.read(64)
+    except (serial.SerialException, OSError) as e:
+        print(f"[{port}] Probe {baud}/{parity}/{sb} failed: {e}")
+        return None
+    print("----------------------------------------Sample data:", data)
+    if data and data != b'\x00' * len(data):
+        return data
+    return None
 
-while True:
+def probe_adapter(port, found):
+    # settings on one adapter are tried in turn; stop early once any adapter hit
     for baud in baud_rates:
         for parity in parities:
             for sb in stopbits:
-                try:
-                    print(f"Testing {baud} baud, parity={parity}, stopbits={sb}")
-                    ser = serial.Serial(PORT, baud, timeout=0.5, parity=parity, stopbits=sb)
+                if found.is_set():
+                    return None
+                data = probe(port, baud, parity, sb)
+                if data:
+                    found.set()
+                    return port, baud, parity, sb, data
+    return None
 
-                    data = ser.read(64)
-                    ser.close()
-                    print("----------------------------------------Sample data:", data) 
-                    if data and data != b'\x00' * len(data):
-                        print(f"\n\n===== SUCCESS! =====")
-                        print(f"Settings: baud={baud}, parity={parity}, stopbits={sb}")
-                        print("Sample data:", data)
-                        exit()
-                except Exception as e:
-                    pass
+def detect():
+    found = threading.Event()
+    with ThreadPoolExecutor(max_workers=len(ADAPTERS)) as ex:
+        futures = [ex.submit(probe_adapter, port, found) for port in ADAPTERS]
+        for future in as_completed(futures):
+            result = future.result()
+            if result:
+                return result
+    return None
 
-print("\nNo valid setting found. Try swapping A/B or check wiring.")
+def main():
+    print("Starting auto-detect...\n")
+    while True:
+        result = detect()
+        if result:
+            port, baud, parity, sb, data = result
+            print(f"\n\n===== SUCCESS! =====")
+            print(f"Settings: port={port}, baud={baud}, parity={parity}, stopbits={sb}")
+            print("Sample data:", data)
+            return result
+        print(f"\nNo valid setting found. Try swapping A/B or check wiring. Retrying in {RETRY_DELAY_SEC} sec...")
+        time.sleep(RETRY_DELAY_SEC)
+
+if __name__ == "__main__":
+    main()
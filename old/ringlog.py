@@ -0,0 +1,83 @@
+import mmap
+import os
+import struct
+import time
+
+# File layout: a header with the write (head) and oldest-record (tail)
+# offsets, then records packed back to back. A record is an 8-byte ns
+# timestamp, a 2-byte payload length and the payload. A record with length
+# WRAP_MARK means "continue at DATA_START". tail == 0 means empty.
+HEADER = struct.Struct("<QQ")
+RECORD = struct.Struct("<QH")
+DATA_START = HEADER.size
+WRAP_MARK = 0xFFFF
+MAX_PAYLOAD = WRAP_MARK - 1
+DEFAULT_SIZE = 64 << 20
+
+class RingLog:
+    """Fixed-size circular log in an mmap'd file; the oldest records are overwritten."""
+
+    def __init__(self, path: str, size: int = DEFAULT_SIZE):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.size = size
+        self.head, self.tail = HEADER.unpack_from(self.mm, 0)
+        if not DATA_START <= self.head < size:
+            self.head, self.tail = DATA_START, 0  # new or foreign file
+
+    def _drop_oldest(self, start: int, end: int):
+        # advance tail past every record that [start, end) is about to overwrite
+        while self.tail and start <= self.tail < end:
+            _, length = RECORD.unpack_from(self.mm, self.tail)
+            if length == WRAP_MARK:
+                self.tail = DATA_START
+            else:
+                self.tail += RECORD.size + length
+            if self.tail == self.head:
+                self.tail = 0
+
+    def append(self, payload: bytes, ts_ns: int = None):
+        payload = payload[:MAX_PAYLOAD]
+        need = RECORD.size + len(payload)
+        if ts_ns is None:
+            ts_ns = time.time_ns()
+        mm = self.mm
+        # keep room behind every record for a wrap marker
+        if self.head + need + RECORD.size > self.size:
+            self._drop_oldest(self.head, self.size)
+            RECORD.pack_into(mm, self.head, 0, WRAP_MARK)
+            self.head = DATA_START
+        self._drop_oldest(self.head, self.head + need)
+        if not self.tail:
+            self.tail = self.head
+        RECORD.pack_into(mm, self.head, ts_ns, len(payload))
+        mm[self.head + RECORD.size:self.head + need] = payload
+        self.head += need
+        HEADER.pack_into(mm, 0, self.head, self.tail)
+
+    def records(self):
+        """Yield (ts_ns, payload) from oldest to newest."""
+        pos = self.tail
+        if not pos:
+            return
+        first = True
+        while first or pos != self.head:
+            first = False
+            ts_ns, length = RECORD.unpack_from(self.mm, pos)
+            if length == WRAP_MARK:
+                pos = DATA_START
+                continue
+            start = pos + RECORD.size
+            yield ts_ns, bytes(self.mm[start:start + length])
+            pos = start + length
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.close()
@@ -1,8 +1,38 @@
 import serial
 import time
+import sys
+import select
+import struct
+import fcntl
+import termios
 
 PORT = "/dev/ttyUSB0"   # FTDI USB-to-RS485 adapter
 BAUD = 19200           # Try 9600 or 19200 if no output
+READ_SIZE = 128        # least free space kept for a serial read
+BUFFER_SIZE = 8192     # fixed receive buffer, never grows
+MAX_LINE = 4096        # longer lines are garbage and get discarded
+SELECT_TIMEOUT = 1.0   # seconds to wait for the port to become readable
+OUT_FLUSH_SIZE = 4096  # write batched output once it grows this big...
+OUT_IDLE_SEC = 0.05    # ...or once the bus has been quiet this long
+ASYNC_LOW_LATENCY = 0x2000
+SERIAL_STRUCT_SIZE = 128   # >= sizeof(struct serial_struct)
+SERIAL_FLAGS_OFFSET = 16   # int flags follows type, line, port, irq
+
+def set_low_latency(fd):
+    """
+    Ask the tty driver for low latency. On FTDI adapters this drops the
+    16 ms latency timer to 1 ms so short frames are not held back.
+    """
+    ss = bytearray(SERIAL_STRUCT_SIZE)
+    try:
+        fcntl.ioctl(fd, termios.TIOCGSERIAL, ss)
+        flags = struct.unpack_from("i", ss, SERIAL_FLAGS_OFFSET)[0]
+        struct.pack_into("i", ss, SERIAL_FLAGS_OFFSET, flags | ASYNC_LOW_LATENCY)
+        fcntl.ioctl(fd, termios.TIOCSSERIAL, ss)
+        return True
+    except OSError as e:
+        print(f"[WARN] Low latency mode not supported: {e}")
+        return False
 
 def open_serial():
     while True:
@@ -10,11 +40,12 @@ def open_serial():
             ser = serial.Serial(
                 port=PORT,
                 baudrate=BAUD,
-                timeout=0.5,
+                timeout=0,   # reads return what is there, select() does the waiting
                 parity=serial.PARITY_NONE,
                 stopbits=serial.STOPBITS_ONE,
                 bytesize=serial.EIGHTBITS
             )
+            set_low_latency(ser.fd)
             print(f"[OK] Connected to {PORT} at {BAUD} baud")
             return ser
         except serial.SerialException:
@@ -23,37 +54,75 @@ def open_serial():
 
 def main():
     ser = open_serial()
-    buffer = ""
+    buf = bytearray(BUFFER_SIZE)
+    mv = memoryview(buf)
+    head = 0     # start of the unconsumed bytes
+    tail = 0     # end of the received bytes
+    search = 0   # bytes before this offset are known to hold no newline
+    skipping = False  # rest of a discarded overlong line is still arriving
+    out = bytearray()  # [RECV] lines not written to stdout yet
+    stdout = sys.stdout.buffer
+
+    def flush_out():
+        stdout.write(out)
+        stdout.flush()
+        out.clear()
 
     print("---- RS485 Sniffer (Printer Mode) ----")
     print("Waiting for data...")
+    sys.stdout.flush()
+    sys.stdout.reconfigure(line_buffering=False, write_through=False)
 
     while True:
         try:
-            data = ser.read(128)   # read small chunks continuously
-            if data:
-                try:
-                    decoded = data.decode("utf-8", errors="ignore")
-                except:
-                    decoded = str(data)
-
-                buffer += decoded
-
-                # Process line-by-line
-                if "\n" in buffer:
-                    lines = buffer.split("\n")
-                    for line in lines[:-1]:   # each full line
-                        clean = line.strip()
-                        if clean:
-                            print(f"[RECV] {clean}")
-                    buffer = lines[-1]  # remainder (partial line)
+            if tail + READ_SIZE > BUFFER_SIZE:
+                # out of room at the end: move the partial line to the front
+                buf[:tail - head] = mv[head:tail]
+                search -= head
+                tail -= head
+                head = 0
+            readable, _, _ = select.select([ser.fd], [], [], OUT_IDLE_SEC if out else SELECT_TIMEOUT)
+            if not readable:
+                if out:
+                    flush_out()
+                continue
+            # one call takes the whole burst the driver has queued, not 128 bytes of it
+            n = ser.readinto(mv[tail:])   # pyserial reads into a bytes object and copies it here
+            if not n:
+                continue
+            tail += n
+
+            # All complete lines of this read are framed, decoded and
+            # formatted by a few C-level calls instead of a Python step per line
+            last = buf.rfind(b"\n", search, tail)
+            if last != -1:
+                lines = bytes(mv[head:last]).decode("utf-8", errors="ignore").split("\n")
+                if skipping:
+                    del lines[0]
+                    skipping = False
+                lines = [line for line in map(str.strip, lines) if line]
+                if lines:
+                    out += ("[RECV] " + "\n[RECV] ".join(lines) + "\n").encode()
+                head = last + 1
+            if head == tail:
+                head = tail = 0
+            elif tail - head > MAX_LINE:
+                flush_out()
+                print(f"[WARN] Discarding {tail - head} bytes without a line ending", flush=True)
+                head = tail = 0
+                skipping = True
+            search = tail
+            if len(out) >= OUT_FLUSH_SIZE:
+                flush_out()
 
         except KeyboardInterrupt:
-            print("\nStopping sniffer.")
+            flush_out()
+            print("\nStopping sniffer.", flush=True)
             break
         
         except Exception as e:
-            print(f"[ERROR] {e}")
+            flush_out()
+            print(f"[ERROR] {e}", flush=True)
             time.sleep(1)
 
 if __name__ == "__main__":
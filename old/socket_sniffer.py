@@ -1,53 +1,279 @@
 import socket
-from datetime import datetime
+import selectors
+import atexit
+import time
 import os
+import sys
+import fcntl
+import threading
+import ringlog
 
 HOST = ""               # Listen on all network interfaces
 PORT = 5005             # Device port setting
 LOG_FILE = "socket_log.txt"
+RECV_SIZE = 65536       # bytes per recv() while draining a ready socket
+RCVBUF_SIZE = 1 << 20   # kernel receive buffer, lets segments pile up between reads
+LOG_BUFFER_SIZE = 1 << 16  # staged log bytes that trigger an early flush
+LOG_FLUSH_SEC = 0.02    # the flusher thread writes staged lines this often
+ACCEPT_BATCH = 64       # connections accepted per readiness event
+MAX_LINE_SIZE = 8192    # a partial line this long is emitted without waiting for its newline
+RAW_LOG_FILE = "socket_raw.log"  # --raw: received bytes, unframed and untimestamped
+RING_LOG_FILE = "socket.ringlog"  # --ring: fixed-size binary log, read it with dumplog.py
+PIPE_SIZE = 1 << 20
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
 
-def log_to_file(text):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    line = f"[{timestamp}] {text}\n"
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(line)
+_log_fd = None          # opened once, see open_log()
+_stage = bytearray()    # log lines not written yet (group commit)
+_stage_lock = threading.Lock()
+_write_lock = threading.Lock()  # keeps flushes in order
+_flush_wake = threading.Event()
+_flush_stop = threading.Event()
+_ts_sec = -1            # second _ts_str was formatted for
+_ts_str = ""
+_raw = None             # (pipe_r, pipe_w, raw_fd) while in --raw mode
+_ring = None            # ringlog.RingLog while in --ring mode
+_recv_buf = bytearray(RECV_SIZE)  # reused by every recv_into, the loop is single threaded
+_recv_view = memoryview(_recv_buf)
 
-def start_server():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.bind((HOST, PORT))
-    sock.listen(1)
+class PerConn:
+    """Per-connection state: peer address and not yet terminated bytes."""
+    __slots__ = ("addr", "buffer")
 
-    print(f"[OK] Socket sniffer listening on port {PORT}")
-    print(f"[LOG] Logging to: {os.path.abspath(LOG_FILE)}")
-    print("Waiting for device connection...\n")
+    def __init__(self, addr):
+        self.addr = addr
+        self.buffer = bytearray()
+
+def open_log():
+    """
+    Open LOG_FILE once and start the flusher thread that writes the staged
+    lines in one go every LOG_FLUSH_SEC. Everything is flushed at exit.
+    """
+    global _log_fd
+    if _log_fd is None:
+        _log_fd = os.open(LOG_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        threading.Thread(target=flusher_task, name="log-flusher", daemon=True).start()
+        atexit.register(close_log)
+    return _log_fd
+
+def flush_log():
+    with _write_lock:
+        with _stage_lock:
+            if not _stage:
+                return
+            data = bytes(_stage)
+            _stage.clear()
+        view = memoryview(data)
+        while view:
+            view = view[os.write(_log_fd, view):]
+
+def flusher_task():
+    while not _flush_stop.is_set():
+        _flush_wake.wait(LOG_FLUSH_SEC)
+        _flush_wake.clear()
+        flush_log()
 
-    while True:
-        conn, addr = sock.accept()
+def close_log():
+    global _log_fd
+    if _log_fd is None:
+        return
+    _flush_stop.set()
+    _flush_wake.set()
+    flush_log()
+    os.close(_log_fd)
+    _log_fd = None
+
+def timestamp():
+    # lines within the same second share one formatted string
+    global _ts_sec, _ts_str
+    now = int(time.time())
+    if now != _ts_sec:
+        _ts_sec = now
+        _ts_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+    return _ts_str
+
+def log_to_file(*texts):
+    """Stage one timestamped line per text for the flusher thread."""
+    if _ring is not None:
+        # binary records carry their own ns timestamp, nothing to format
+        for text in texts:
+            _ring.append(text.encode("utf-8"))
+        return
+    if _log_fd is None:
+        open_log()
+    ts = timestamp()
+    data = "".join(f"[{ts}] {text}\n" for text in texts).encode("utf-8")
+    with _stage_lock:
+        _stage.extend(data)
+        full = len(_stage) >= LOG_BUFFER_SIZE
+    if full:
+        _flush_wake.set()
+
+def decode_line(data):
+    try:
+        return data.decode("utf-8", errors="ignore").strip()
+    except:
+        return str(data)
+
+def emit_lines(texts):
+    texts = [text for text in texts if text]
+    if not texts:
+        return
+    print("\n".join(f"[RECV] {text}" for text in texts))
+    log_to_file(*texts)
+
+def accept_conn(sel, sock):
+    # take every pending connection while we are here, not one per select()
+    for _ in range(ACCEPT_BATCH):
+        try:
+            conn, addr = sock.accept()
+        except BlockingIOError:
+            break
+        conn.setblocking(False)
+        sel.register(conn, selectors.EVENT_READ, data=PerConn(addr))
         print(f"[CONNECTED] Device at {addr}")
         log_to_file(f"CONNECTED from {addr}")
 
-        try:
-            while True:
-                data = conn.recv(4096)
-                if not data:
-                    print("[DISCONNECTED] Device closed connection")
-                    log_to_file("DISCONNECTED")
-                    break
+def close_conn(sel, conn, state):
+    # whatever is left without a trailing newline is still a message
+    if state.buffer:
+        emit_lines([decode_line(bytes(state.buffer))])
+        state.buffer.clear()
+    sel.unregister(conn)
+    conn.close()
+
+def service_conn(sel, conn, state):
+    # drain the socket until it would block, then split out full lines
+    try:
+        closed = False
+        while True:
+            try:
+                n = conn.recv_into(_recv_buf)
+            except BlockingIOError:
+                break
+            if not n:
+                closed = True
+                break
+            state.buffer += _recv_view[:n]
+
+        buf = state.buffer
+        texts = []
+        start = 0
+        while True:
+            end = buf.find(b"\n", start)
+            if end < 0:
+                break
+            texts.append(decode_line(bytes(buf[start:end])))
+            start = end + 1
+        if start:
+            del buf[:start]
+        if len(buf) >= MAX_LINE_SIZE:
+            # a peer that never sends a newline must not grow the buffer forever
+            texts.append(decode_line(bytes(buf)))
+            buf.clear()
+        emit_lines(texts)
+
+        if closed:
+            close_conn(sel, conn, state)
+            print(f"[DISCONNECTED] Device at {state.addr} closed connection")
+            log_to_file(f"DISCONNECTED {state.addr}")
+
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        log_to_file(f"ERROR: {e}")
+        if conn.fileno() != -1:
+            close_conn(sel, conn, state)
+
+def open_raw():
+    """
+    Pipe + log fd for splicing socket bytes into RAW_LOG_FILE inside the
+    kernel. Not opened O_APPEND, splice() refuses append-mode targets.
+    """
+    raw_fd = os.open(RAW_LOG_FILE, os.O_WRONLY | os.O_CREAT, 0o644)
+    os.lseek(raw_fd, 0, os.SEEK_END)
+    pipe_r, pipe_w = os.pipe()
+    try:
+        fcntl.fcntl(pipe_w, F_SETPIPE_SZ, PIPE_SIZE)
+    except OSError:
+        pass  # above /proc/sys/fs/pipe-max-size, keep the default
+    return pipe_r, pipe_w, raw_fd
+
+def close_raw():
+    global _raw
+    if _raw is not None:
+        for fd in _raw:
+            os.close(fd)
+        _raw = None
 
-                try:
-                    text = data.decode("utf-8", errors="ignore").strip()
-                except:
-                    text = str(data)
+def service_conn_raw(sel, conn, state):
+    # socket -> pipe -> file, the bytes never reach user space
+    pipe_r, pipe_w, raw_fd = _raw
+    try:
+        while True:
+            try:
+                n = os.splice(conn.fileno(), pipe_w, RECV_SIZE,
+                              flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                return
+            if not n:
+                close_conn(sel, conn, state)
+                print(f"[DISCONNECTED] Device at {state.addr} closed connection")
+                log_to_file(f"DISCONNECTED {state.addr}")
+                return
+            while n:
+                n -= os.splice(pipe_r, raw_fd, n, flags=os.SPLICE_F_MOVE | os.SPLICE_F_MORE)
 
-                print(f"[RECV] {text}")
-                log_to_file(text)
+    except Exception as e:
+        print(f"[ERROR] {e}")
+        log_to_file(f"ERROR: {e}")
+        if conn.fileno() != -1:
+            close_conn(sel, conn, state)
 
-        except Exception as e:
-            print(f"[ERROR] {e}")
-            log_to_file(f"ERROR: {e}")
+def start_server(raw=False, ring=False):
+    global _raw, _ring
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # set before listen() so accepted sockets inherit it and the window scale fits
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF_SIZE)
+    sock.bind((HOST, PORT))
+    sock.listen()
+    sock.setblocking(False)
+
+    # epoll on Linux: only ready sockets are returned, any number of devices
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ, data=None)
+    if ring:
+        _ring = ringlog.RingLog(RING_LOG_FILE)
+    else:
+        open_log()
+    if raw and not hasattr(os, "splice"):
+        print("[WARN] os.splice needs Python 3.10+ on Linux, logging lines instead")
+        raw = False
+    if raw:
+        _raw = open_raw()
+    service = service_conn_raw if raw else service_conn
+
+    print(f"[OK] Socket sniffer listening on port {PORT}")
+    print(f"[LOG] Logging to: {os.path.abspath(RING_LOG_FILE if ring else LOG_FILE)}")
+    if raw:
+        print(f"[LOG] Raw bytes to: {os.path.abspath(RAW_LOG_FILE)}")
+    print("Waiting for device connection...\n")
 
-        finally:
-            conn.close()
+    try:
+        while True:
+            for key, _ in sel.select(timeout=None):
+                if key.data is None:
+                    accept_conn(sel, key.fileobj)
+                else:
+                    service(sel, key.fileobj, key.data)
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+        if _ring is not None:
+            _ring.close()
+            _ring = None
+        else:
+            flush_log()
+        close_raw()
 
 if __name__ == "__main__":
-    start_server()
\ No newline at end of file
+    start_server(raw="--raw" in sys.argv[1:], ring="--ring" in sys.argv[1:])
@@ -3,37 +3,80 @@ from gpiod.line import Direction, Value
 
 DEFAULT_CHIP_PATH = "/dev/gpiochip4"
 
+# the same settings serve every output line, build them once
+OUTPUT_SETTINGS = gpiod.LineSettings(
+    direction=Direction.OUTPUT,
+    active_low=False,  # Set to True if active low, False for active high
+    output_value=Value.INACTIVE
+)
+
+_REQS = {}   # chip_path -> request shared by all relays on that chip, see Relay.configure_lines
+_LINES = {}  # chip_path -> lines covered by the shared request
+
+def _debug_print(fmt, *args):
+    print(fmt % args if args else fmt)
+
+def _no_debug_print(*_):
+    pass
+
+def debug_printer(debug: bool):
+    """debug_print(fmt, *args) that formats only when debug is on."""
+    return _debug_print if debug else _no_debug_print
+
 class Relay:
     def __init__(self, gpio_line: int, chip_path: str = DEFAULT_CHIP_PATH, debug: bool = False):
         self.gpio_line = gpio_line
+        self.chip_path = chip_path
         self.debug = debug
+        self.debug_print = debug_printer(debug)
         
-        config = {
-            self.gpio_line: gpiod.LineSettings(
-                direction=Direction.OUTPUT,
-                active_low=False,  # Set to True if active low, False for active high
-                output_value=Value.INACTIVE
-            )
-        }
-        self.req = gpiod.request_lines(chip_path, config)
+        if gpio_line in _LINES.get(chip_path, ()):
+            self.req = _REQS[chip_path]  # pre-declared, no new request or fd
+            self.owns_req = False
+        else:
+            self.req = gpiod.request_lines(chip_path, {self.gpio_line: OUTPUT_SETTINGS})
+            self.owns_req = True
+        # bound once so a toggle is a single call without attribute lookups
+        self._set = self.req.set_value
+        self._line = self.gpio_line
+        self._ACTIVE = Value.ACTIVE
+        self._INACTIVE = Value.INACTIVE
         
-        self.debug_print(f"[Relay] Initializing Relay on GPIO line {self.gpio_line} at {chip_path}")
+        self.debug_print("[Relay] Initializing Relay on GPIO line %d at %s", self.gpio_line, chip_path)
+        
+    @classmethod
+    def configure_lines(cls, chip_path: str, lines):
+        """
+        Request all lines of a chip in one go. Relays created afterwards for
+        these lines share that request instead of opening their own.
+        """
+        if chip_path in _REQS:
+            return
+        lines = tuple(sorted(set(lines)))
+        _REQS[chip_path] = gpiod.request_lines(chip_path, {lines: OUTPUT_SETTINGS})
+        _LINES[chip_path] = frozenset(lines)
+        
+    @classmethod
+    def release_lines(cls, chip_path: str = DEFAULT_CHIP_PATH):
+        """Release the shared request made by configure_lines."""
+        req = _REQS.pop(chip_path, None)
+        _LINES.pop(chip_path, None)
+        if req is not None:
+            req.release()
         
-    def debug_print(self, message: str):
-        if self.debug:
-            print(message)
-
     def turn_on(self):
-        self.req.set_value(self.gpio_line, Value.ACTIVE)
-        self.debug_print(f"[Relay] Relay on GPIO line {self.gpio_line} turned ON")
+        self._set(self._line, self._ACTIVE)
+        self.debug_print("[Relay] Relay on GPIO line %d turned ON", self._line)
 
     def turn_off(self):
-        self.req.set_value(self.gpio_line, Value.INACTIVE)
-        self.debug_print(f"[Relay] Relay on GPIO line {self.gpio_line} turned OFF")
+        self._set(self._line, self._INACTIVE)
+        self.debug_print("[Relay] Relay on GPIO line %d turned OFF", self._line)
         
     def release(self):
+        if not self.owns_req:
+            return  # shared request, freed by Relay.release_lines
         self.req.release()
-        self.debug_print(f"[Relay] Released GPIO line {self.gpio_line}")
+        self.debug_print("[Relay] Released GPIO line %d", self.gpio_line)
         
     def __exit__(self):
         """
@@ -1,23 +1,32 @@
-from relay import Relay
+from relay import Relay, debug_printer
 import time
+import asyncio
 
 class Slave:
     def __init__(self, relay_gpio_line: int, num: int, debug: bool = False):
         self.relay = Relay(relay_gpio_line, debug=debug)
         self.num = num
         self.debug = debug
-        self.debug_print(f"[Slave][#{self.num}]: initialized")
+        self.debug_print = debug_printer(debug)
+        self.debug_print("[Slave][#%d]: initialized", self.num)
         
     def power_cycle(self, off_duration: int = 5):
-        self.debug_print(f"[Slave][#{self.num}]: Powering OFF the slave device.")
+        self.debug_print("[Slave][#%d]: Powering OFF the slave device.", self.num)
         self.relay.turn_on()  # Assuming active HIGH turns OFF the slave
         time.sleep(off_duration)
-        self.debug_print(f"[Slave][#{self.num}]: Powering ON the slave device.")
+        self.debug_print("[Slave][#%d]: Powering ON the slave device.", self.num)
         self.relay.turn_off()  # Assuming inactive LOW turns ON the slave
         
-    def debug_print(self, message: str):
-        if self.debug:
-            print(message)
+    async def power_cycle_async(self, off_duration: int = 5):
+        """power_cycle for an asyncio loop: the off time yields instead of blocking."""
+        self.debug_print("[Slave][#%d]: Powering OFF the slave device.", self.num)
+        self.relay.turn_on()
+        await asyncio.sleep(off_duration)
+        self.debug_print("[Slave][#%d]: Powering ON the slave device.", self.num)
+        self.relay.turn_off()
+        
+    def release(self):
+        self.relay.release()
 
 if __name__ == "__main__":
     slave = Slave(relay_gpio_line=27, num=0, debug=True)